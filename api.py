@@ -0,0 +1,174 @@
+import gzip
+import json
+from datetime import date, datetime
+from flask import Response, request
+from app_config import app, db
+from models import Venue, Artist, Show, City, Genre, genres_venues, genres_artists, show_partition
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+
+#----------------------------------------------------------------------------#
+# JSON API.
+#----------------------------------------------------------------------------#
+# Read-only /api/v1 endpoints for venues, artists, shows, cities and genres.
+# ?fields= selects only the listed columns, lists are paged by id keyset
+# (?after=<last id>&limit=) and responses are gzip or brotli compressed.
+
+API_RESOURCES = {
+  'venues': (Venue, (
+    'id', 'name', 'address', 'phone', 'image_link', 'facebook_link', 'website',
+    'seeking_talent', 'seeking_description', 'city_id',
+    'past_shows_count', 'upcoming_shows_count', 'updated_at',
+  )),
+  'artists': (Artist, (
+    'id', 'name', 'phone', 'image_link', 'facebook_link', 'website',
+    'seeking_venue', 'seeking_description', 'city_id',
+    'past_shows_count', 'upcoming_shows_count', 'updated_at',
+  )),
+  'shows': (Show, ('id', 'artist_id', 'venue_id', 'start_time', 'updated_at')),
+  'cities': (City, ('id', 'name', 'state_id')),
+  'genres': (Genre, ('id', 'name')),
+}
+
+# detail endpoints add the genres and the past/upcoming show split
+DETAIL_RELATIONS = {
+  'venues': (genres_venues, 'venue_id', Show.venue_id, Artist, 'artist'),
+  'artists': (genres_artists, 'artist_id', Show.artist_id, Venue, 'venue'),
+}
+
+MAX_LIMIT = 200
+COMPRESS_MIN_SIZE = 512
+
+
+class APIError(Exception):
+
+  def __init__(self, message, status=400):
+    super().__init__(message)
+    self.message = message
+    self.status = status
+
+
+def _default(value):
+  if isinstance(value, (datetime, date)):
+    return value.isoformat()
+  raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(data):
+  """
+  Returns data as JSON bytes, through orjson when it is installed
+  """
+  if orjson is not None:
+    return orjson.dumps(data, default=_default)
+  return json.dumps(data, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(data, status=200):
+  return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def requested_fields(resource):
+  """
+  Returns the columns named by ?fields=, all columns when it is absent.
+  The id is always included, since pages are keyed on it.
+  """
+  model, columns = API_RESOURCES[resource]
+  fields = request.args.get('fields')
+  if not fields:
+    return columns
+  names = [name.strip() for name in fields.split(',') if name.strip()]
+  unknown = [name for name in names if name not in columns]
+  if unknown:
+    raise APIError(f"Unknown fields for {resource}: {', '.join(unknown)}")
+  return ('id',) + tuple(name for name in names if name != 'id')
+
+
+def select_columns(resource, fields):
+  model, columns = API_RESOURCES[resource]
+  return db.session.query(*[getattr(model, field) for field in fields])
+
+
+@app.errorhandler(APIError)
+def api_error(error):
+  return json_response({'error': error.message}, error.status)
+
+
+@app.route('/api/v1/<resource>')
+def api_list(resource):
+  if resource not in API_RESOURCES:
+    raise APIError(f'Unknown resource {resource}', 404)
+  model, columns = API_RESOURCES[resource]
+  fields = requested_fields(resource)
+  limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_LIMIT)
+  after = request.args.get('after', type=int)
+
+  query = select_columns(resource, fields)
+  if after is not None:
+    query = query.filter(model.id > after)
+  rows = query.order_by(model.id).limit(limit + 1).all()
+  next_after = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_after = rows[-1].id
+  return json_response({
+    'data': [dict(zip(fields, row)) for row in rows],
+    'next': next_after,
+  })
+
+
+@app.route('/api/v1/<resource>/<int:record_id>')
+def api_detail(resource, record_id):
+  if resource not in API_RESOURCES:
+    raise APIError(f'Unknown resource {resource}', 404)
+  model, columns = API_RESOURCES[resource]
+  fields = requested_fields(resource)
+  row = select_columns(resource, fields).filter(model.id == record_id).first()
+  if row is None:
+    raise APIError(f'{resource} {record_id} not found', 404)
+  data = dict(zip(fields, row))
+
+  if resource in DETAIL_RELATIONS:
+    genre_table, owner_key, owner_column, other, prefix = DETAIL_RELATIONS[resource]
+    data['genres'] = [name for name, in db.session.query(Genre.name
+      ).join(genre_table, genre_table.c.genre_id == Genre.id
+      ).filter(genre_table.c[owner_key] == record_id).order_by(Genre.name)]
+    partition = show_partition(owner_column, record_id, other, prefix)
+    # show times have always been 'YYYY-MM-DD HH:MM:SS' in detail responses
+    for show in partition['past_shows'] + partition['upcoming_shows']:
+      show['start_time'] = str(show['start_time'])
+    data.update(partition)
+  return json_response(data)
+
+
+@app.after_request
+def compress_api_response(response):
+  """
+  Compresses /api/ responses with brotli or gzip, as the client accepts
+  """
+  if not request.path.startswith('/api/'):
+    return response
+  response.vary.add('Accept-Encoding')
+  # streamed responses such as exports are sent as they are produced
+  if (response.is_streamed or response.direct_passthrough or response.status_code != 200
+      or 'Content-Encoding' in response.headers):
+    return response
+  body = response.get_data()
+  if len(body) < COMPRESS_MIN_SIZE:
+    return response
+  accepted = request.accept_encodings
+  if brotli is not None and accepted['br']:
+    response.set_data(brotli.compress(body))
+    response.headers['Content-Encoding'] = 'br'
+  elif accepted['gzip']:
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+  return response
@@ -3,8 +3,6 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
 from flask import Flask, render_template, request, Response, flash, redirect, url_for, Response, jsonify
 from flask_sqlalchemy import SQLAlchemy
 import logging
@@ -12,83 +10,126 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy.exc import IntegrityError
 from app_config import app, db
 from models import Venue, City, State, Artist, Show, Genre
+from queries import venue_areas, show_feed
+from search import search
+from autocomplete import suggestions, load_suggestions
+from counters import refresh_show_counters
+import query_plans  # registers the check-query-plans command
+import api  # registers the /api/v1 routes
+import bulk_import  # registers the import-data command
+import export  # registers the export-data command and /api/v1/export
+import profiler  # registers the query profiler and the check-query-budgets command
+import thumbnails  # registers /img thumbnails and the thumbnail() template helper
+import assets  # registers the build-assets command and fingerprinted static URLs
+import template_cache  # registers the compile-templates command and the bytecode cache
+import benchmark  # registers the seed-data and benchmark commands
+from conditional import conditional, touch
+from jobs import enqueue  # also registers the work-jobs command
+from page_cache import cached_page, evict, evict_venue, evict_artist, evict_show
+from reference import resolve_city, resolve_genres, city_and_state, load_reference_data, reference_stats
+from db_pool import pool_stats
+from formatting import format_datetime
 #----------------------
 # ------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
-
 app.jinja_env.filters['datetime'] = format_datetime
 
+def parse_date(value):
+  """
+  Returns a datetime for a YYYY-MM-DD query argument, or None
+  """
+  try:
+    return datetime.strptime(value, '%Y-%m-%d')
+  except (TypeError, ValueError):
+    return None
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
+@app.before_first_request
+def warm_caches():
+  load_reference_data()
+  load_suggestions()
+
+
 @app.route('/')
 def index():
   return render_template('pages/home.html')
 
 
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/api/autocomplete')
+def autocomplete_suggestions():
+  prefix = request.args.get('q', '')
+  limit = min(request.args.get('limit', 10, type=int), 50)
+  kinds = request.args.getlist('type') or None
+  results = [
+    {'type': kind, 'id': record_id, 'name': name}
+    for kind, record_id, name in suggestions.complete(prefix, limit, kinds)
+  ]
+  return jsonify({'results': results})
+
+
+@app.route('/api/reference/stats')
+def reference_cache_stats():
+  return jsonify(reference_stats())
+
+
+@app.route('/api/metrics/pool')
+def pool_metrics_stats():
+  return jsonify(pool_stats(db.engine))
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@cached_page('venues')
 def venues():
-  city_list = City.query.all()
-  data = []
-  for city in city_list:
-    city_dict = {
-      'city': city.name,
-      'state': city.state.name,
-      'venues': city.venues
-    }
-    data.append(city_dict)
-  return render_template('pages/venues.html', areas=data)
+  cursor = request.args.get('after')
+  data, next_cursor = venue_areas(cursor, per_page=app.config['VENUES_PER_PAGE'])
+  return render_template('pages/venues.html', areas=data, next_cursor=next_cursor)
 
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  search_term = request.form.get('search_term')
-  venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-  response={
-    "count": len(venues),
-    "data": venues,
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+  search_term = request.form.get('search_term', '')
+  page = request.form.get('page', 1, type=int)
+  response = search('venue', search_term, page, per_page=app.config['SEARCH_PER_PAGE'])
+  return render_template('pages/search_venues.html', results=response,
+    search_term=search_term, page=page, per_page=app.config['SEARCH_PER_PAGE'])
 
 
 @app.route('/venues/<int:venue_id>')
+@conditional(Venue, 'venue_id')
+@cached_page('venue:{venue_id}')
 def show_venue(venue_id):
   venue = Venue.query.filter_by(id=venue_id).first_or_404()
+  city, state = city_and_state(venue.city_id)
   data = {
     "id": venue.id,
     "name": venue.name,
     "genres": venue.genres,
     "address": venue.address,
-    "city": venue.city.name,
-    "state": venue.city.state.name,
+    "city": city,
+    "state": state,
     "phone": venue.phone,
     "website": venue.website,
     "facebook_link": venue.facebook_link,
     "seeking_talent": venue.seeking_talent,
     "seeking_description": venue.seeking_description,
     "image_link": venue.image_link,
-    "past_shows": venue.past_shows,
-    "upcoming_shows": venue.upcoming_shows,
-    "past_shows_count": venue.past_shows_count,
-    "upcoming_shows_count": venue.num_upcoming_shows,
   }
+  data.update(venue.show_partition())
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
@@ -102,14 +143,10 @@ def create_venue_form():
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   form_data = request.form
-  state_name =  form_data.get('state')
-  state = State.query.filter_by(name=state_name).first()
-  city_name = form_data.get('city')
-  city = City.query.filter(City.name.ilike(f'{city_name}')).first()
-  genres_list = form_data.getlist('genres')
-  genres_objs = [Genre.query.filter_by(name=genre).first() for genre in genres_list]
 
   try:
+    city_id = resolve_city(form_data.get('city'), form_data.get('state'))
+    genres_objs = resolve_genres(form_data.getlist('genres'))
     venue = Venue()
     venue.name = form_data.get('name', 'Name')
     venue.address = form_data.get('address' , 'Address')
@@ -120,14 +157,13 @@ def create_venue_submission():
     if form_data.get('seeking_talent') == 'y':
       venue.seeking_talent = True
     venue.seeking_description = form_data.get('seeking_description')
-    if city is None:
-      new_city = City(name=city_name, state=state)
-      venue.city = new_city
-    else:
-      venue.city = city
+    venue.city_id = city_id
     venue.genres = genres_objs
     db.session.add(venue)
     db.session.commit()
+    suggestions.add('venue', venue.id, venue.name)
+    suggestions.add('city', venue.city.id, venue.city.name)
+    evict('venues')
     flash('Venue ' + form_data['name'] + ' was successfully listed!')
   except IntegrityError:
     flash('An error occurred. Venue ' + form_data['name'] + ' already exits!.')
@@ -143,9 +179,15 @@ def create_venue_submission():
 @app.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   venue = Venue.query.filter_by(id=venue_id).first_or_404()
+  venue_name = venue.name
+  artist_ids = [artist_id for artist_id, in
+    db.session.query(Show.artist_id).filter_by(venue_id=venue.id).distinct()]
   try:
     db.session.delete(venue)
+    enqueue('refresh_artists', artist_ids=artist_ids)
     db.session.commit()
+    suggestions.discard('venue', int(venue_id), venue_name)
+    evict_venue(venue_id, artist_ids)
   except:
     db.session.rollback()
   finally:
@@ -156,40 +198,39 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@cached_page('artists')
 def artists():
   data = Artist.query.all()
   return render_template('pages/artists.html', artists=data)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  search_term = request.form.get('search_term')
-  artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
-  response={
-    "count": len(artists),
-    "data": artists
-  }
-  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+  search_term = request.form.get('search_term', '')
+  page = request.form.get('page', 1, type=int)
+  response = search('artist', search_term, page, per_page=app.config['SEARCH_PER_PAGE'])
+  return render_template('pages/search_artists.html', results=response,
+    search_term=search_term, page=page, per_page=app.config['SEARCH_PER_PAGE'])
 
 @app.route('/artists/<int:artist_id>')
+@conditional(Artist, 'artist_id')
+@cached_page('artist:{artist_id}')
 def show_artist(artist_id):
   artist = Artist.query.filter_by(id=artist_id).first_or_404()
+  city, state = city_and_state(artist.city_id)
   artist_dict = {
       'id': artist.id,
       'name': artist.name,
       'genres': artist.genres,
-      'city': artist.city.name,
-      'state': artist.city.state.name,
+      'city': city,
+      'state': state,
       'phone': artist.phone,
       'website': artist.website,
       'facebook_link': artist.facebook_link,
       'seeking_venue': artist.seeking_venue,
       'seeking_description': artist.seeking_description,
       'image_link': artist.image_link,
-      'past_shows': artist.past_shows,
-      'upcoming_shows': artist.upcoming_shows,
-      'past_shows_count': artist.past_shows_count,
-      'upcoming_shows_count': artist.upcoming_shows_count,
   }
+  artist_dict.update(artist.show_partition())
   return render_template('pages/show_artist.html', artist=artist_dict)
 
 #  Update
@@ -204,20 +245,13 @@ def edit_artist(artist_id):
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   artist = Artist.query.filter_by(id=artist_id).first_or_404()
+  old_name = artist.name
   data = request.form
 
-  state = State.query.filter_by(name=data.get('state')).first()
-  city = City.query.filter(City.name.ilike(f"{data.get('city')}")).first()
-  if city is None:
-    new_city = City(name=city_name, state=state)
-    artist.city = new_city
-  else:
-    artist.city = city
-
-  genres_list = data.getlist('genres')
-  genres_objs = [Genre.query.filter_by(name=genre).first() for genre in genres_list]
-  artist.genres = []
-  artist.genres = genres_objs
+  city_id = resolve_city(data.get('city'), data.get('state'))
+  if city_id is not None:
+    artist.city_id = city_id
+  artist.genres = resolve_genres(data.getlist('genres'))
 
   key_list = ['name', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_description']
   for key in key_list:
@@ -230,7 +264,13 @@ def edit_artist_submission(artist_id):
 
   try:
     db.session.add(artist)
+    touch(Artist, [artist_id])
+    enqueue('touch_artist_venues', artist_id=artist_id)
     db.session.commit()
+    suggestions.discard('artist', artist_id, old_name)
+    suggestions.add('artist', artist_id, artist.name)
+    suggestions.add('city', artist.city.id, artist.city.name)
+    evict_artist(artist_id)
     flash('Artist ' + request.form['name'] + ' was successfully updated!')
   except:
     flash('An error occurred. Artist ' + data.name + ' could not be updated.')
@@ -248,20 +288,13 @@ def edit_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   venue = Venue.query.filter_by(id=venue_id).first_or_404()
+  old_name = venue.name
   data = request.form
 
-  state = State.query.filter_by(name=data.get('state')).first()
-  city = City.query.filter(City.name.ilike(f"{data.get('city')}")).first()
-  if city is None:
-    new_city = City(name=city_name, state=state)
-    venue.city = new_city
-  else:
-    venue.city = city
-
-  genres_list = data.getlist('genres')
-  genres_objs = [Genre.query.filter_by(name=genre).first() for genre in genres_list]
-  venue.genres = []
-  venue.genres = genres_objs
+  city_id = resolve_city(data.get('city'), data.get('state'))
+  if city_id is not None:
+    venue.city_id = city_id
+  venue.genres = resolve_genres(data.getlist('genres'))
 
   key_list = ['name', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_description', 'address']
   for key in key_list:
@@ -274,7 +307,13 @@ def edit_venue_submission(venue_id):
 
   try:
     db.session.add(venue)
+    touch(Venue, [venue_id])
+    enqueue('touch_venue_artists', venue_id=venue_id)
     db.session.commit()
+    suggestions.discard('venue', venue_id, old_name)
+    suggestions.add('venue', venue_id, venue.name)
+    suggestions.add('city', venue.city.id, venue.city.name)
+    evict_venue(venue_id)
     flash('Venue ' + request.form['name'] + ' was successfully updated!')
   except:
     flash('An error occurred. Venue ' + data.name + ' could not be updated.')
@@ -294,12 +333,8 @@ def create_artist_form():
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   form_data = request.form
-  state_name =  form_data.get('state')
-  state = State.query.filter_by(name=state_name).first()
-  city_name = form_data.get('city')
-  city = City.query.filter(City.name.ilike(f'{city_name}')).first()
-  genres_list = form_data.getlist('genres')
-  genres_objs = [Genre.query.filter_by(name=genre).first() for genre in genres_list]
+  city_id = resolve_city(form_data.get('city'), form_data.get('state'))
+  genres_objs = resolve_genres(form_data.getlist('genres'))
 
   artist = Artist()
   artist.name = form_data.get('name')
@@ -311,16 +346,15 @@ def create_artist_submission():
   if form_data.get('seeking_venue') == 'y':
     artist.seeking_venue = True
   artist.seeking_description = form_data.get('seeking_description')
-  if city is None:
-    new_city = City(name=city_name, state=state)
-    artist.city = new_city
-  else:
-    artist.city = city
+  artist.city_id = city_id
   artist.genres = genres_objs
 
   try:
     db.session.add(artist)
     db.session.commit()
+    suggestions.add('artist', artist.id, artist.name)
+    suggestions.add('city', artist.city.id, artist.city.name)
+    evict('artists')
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
   except IntegrityError:
     flash('An error occurred. Artist ' + form_data['name'] + ' already exits!.')
@@ -337,20 +371,22 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@cached_page('shows')
 def shows():
-  show_list = Show.query.all()
-  data = []
-  for show in show_list:
-    show_dict = {
-      "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": str(show.start_time)
-    }
-    data.append(show_dict)
-  return render_template('pages/shows.html', shows=data)
+  filters = {
+    'upcoming': request.args.get('upcoming') == '1',
+    'start': parse_date(request.args.get('from')),
+    'end': parse_date(request.args.get('to')),
+  }
+  if filters['end'] is not None:
+    # the "to" date is inclusive
+    filters['end'] += timedelta(days=1)
+  data, next_cursor = show_feed(
+    request.args.get('after'), per_page=app.config['SHOWS_PER_PAGE'], **filters)
+  next_args = None
+  if next_cursor is not None:
+    next_args = dict(request.args.to_dict(), after=next_cursor)
+  return render_template('pages/shows.html', shows=data, next_args=next_args)
 
 @app.route('/shows/create')
 def create_shows():
@@ -370,7 +406,13 @@ def create_show_submission():
     if venue is not None and artist is not None:
       show = Show(artist=artist, venue=venue, start_time=start_time)
       db.session.add(show)
+      db.session.flush()
+      refresh_show_counters(Venue, [venue.id])
+      refresh_show_counters(Artist, [artist.id])
+      touch(Venue, [venue.id])
+      touch(Artist, [artist.id])
       db.session.commit()
+      evict_show(venue.id, artist.id)
       flash('Show was successfully listed!')
     else:
       flash('Venue or Artist does not exist.')
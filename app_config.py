@@ -1,7 +1,7 @@
 from flask import Flask
 from flask_migrate import Migrate
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from replicas import RoutingSQLAlchemy, route_reads_to_replicas
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -10,5 +10,6 @@ from flask_sqlalchemy import SQLAlchemy
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
+route_reads_to_replicas(app, db)
 migrate = Migrate(app, db)
@@ -0,0 +1,262 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import click
+from flask import abort, request, safe_join, send_file, url_for
+from app_config import app
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+try:
+  import rcssmin
+except ImportError:
+  rcssmin = None
+
+try:
+  import rjsmin
+except ImportError:
+  rjsmin = None
+
+
+#----------------------------------------------------------------------------#
+# Static assets.
+#----------------------------------------------------------------------------#
+# `flask build-assets` copies every file under static/ to static/dist/ with
+# a hash of its content in the name, joins the stylesheets and scripts of
+# the layout into the BUNDLES below, minifies what is not minified yet and
+# writes .gz (and, with the brotli package, .br) copies next to them. The
+# manifest it writes maps each source name to its built name; url_for()
+# then links to the built files, which are served precompressed and cached
+# for good, since a change gives them a new name. Without a manifest, or in
+# DEBUG, the source files are linked one by one as before.
+
+BUNDLES = {
+  'css/site.css': [
+    'css/bootstrap.min.css',
+    'css/layout.main.css',
+    'css/main.css',
+    'css/main.responsive.css',
+    'css/main.quickfix.css',
+  ],
+  # scripts the page needs before it is parsed
+  'js/head.js': [
+    'js/libs/modernizr-2.8.2.min.js',
+    'js/libs/moment.min.js',
+  ],
+  # deferred scripts, run in this order once the page is parsed
+  'js/site.js': [
+    'js/script.js',
+    'js/libs/bootstrap-3.1.1.min.js',
+    'js/plugins.js',
+  ],
+}
+
+BUILD_DIR = 'dist'
+
+COMPRESSIBLE = {'.css', '.js', '.map', '.svg', '.json', '.txt', '.eot', '.ttf', '.otf', '.ico'}
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def load_manifest():
+  """
+  Returns {source name: built name} of the last build, or {} when the
+  built assets are not in use
+  """
+  if not app.config['ASSET_FINGERPRINTS']:
+    return {}
+  try:
+    with open(os.path.join(app.static_folder, BUILD_DIR, 'manifest.json')) as manifest_file:
+      return json.load(manifest_file)
+  except FileNotFoundError:
+    app.logger.warning('No static/dist/manifest.json; run `flask build-assets` to serve built assets.')
+    return {}
+
+
+manifest = load_manifest()
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+  if endpoint == 'static' and values.get('filename') in manifest:
+    values['filename'] = manifest[values['filename']]
+
+
+def asset_urls(name):
+  """
+  Returns the URLs to load a bundle (or any static file) from: the built
+  bundle, or its source files when assets are not built
+  """
+  if name in manifest:
+    return [url_for('static', filename=name)]
+  return [url_for('static', filename=source) for source in BUNDLES.get(name, [name])]
+
+app.jinja_env.globals['asset_urls'] = asset_urls
+
+
+def serve_static(filename):
+  """
+  Serves static files as Flask does, except that built files are sent
+  precompressed when the client accepts it, and cached for a year
+  """
+  if not filename.startswith(BUILD_DIR + '/'):
+    return app.send_static_file(filename)
+  # safe_join answers 404 for names leaving the build directory, e.g. with ..
+  path = safe_join(os.path.join(app.static_folder, BUILD_DIR), filename[len(BUILD_DIR) + 1:])
+  if not os.path.isfile(path) or os.path.basename(path) == 'manifest.json':
+    abort(404)
+  encoding = None
+  for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+    if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+      encoding, path = candidate, path + suffix
+      break
+  response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+  if encoding is not None:
+    response.headers['Content-Encoding'] = encoding
+  response.vary.add('Accept-Encoding')
+  response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+  return response
+
+app.view_functions['static'] = serve_static
+
+
+def minify_css(text):
+  """
+  Returns a stylesheet without comments and needless whitespace
+  """
+  if rcssmin is not None:
+    return rcssmin.cssmin(text)
+  text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+  text = re.sub(r'\s+', ' ', text)
+  text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+  text = re.sub(r':\s+', ':', text)
+  return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+  """
+  Returns a minified script; with rjsmin missing, the script unchanged
+  """
+  if rjsmin is not None:
+    return rjsmin.jsmin(text)
+  return text
+
+
+def fingerprinted(name, data):
+  """
+  Returns the built name of a file: css/main.css -> dist/css/main.<hash>.css
+  """
+  stem, extension = posixpath.splitext(name)
+  digest = hashlib.sha256(data).hexdigest()[:10]
+  return posixpath.join(BUILD_DIR, f'{stem}.{digest}{extension}')
+
+
+def source_files(static_folder):
+  for directory, subdirectories, names in os.walk(static_folder):
+    if os.path.relpath(directory, static_folder) == '.':
+      subdirectories[:] = [name for name in subdirectories if name != BUILD_DIR]
+    for name in sorted(names):
+      if not name.startswith('.'):
+        path = os.path.join(directory, name)
+        yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def rewrite_css_urls(text, name, built):
+  """
+  Points the relative url()s of a stylesheet at the built files, or at the
+  source files when they were not built, so the stylesheet can move
+  """
+  def replace(match):
+    target = match.group(2)
+    if target.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+      return match.group(0)
+    path, suffix = re.match(r'([^?#]*)(.*)', target).groups()
+    source = posixpath.normpath(posixpath.join(posixpath.dirname(name), path))
+    return f'url("/static/{built.get(source, source)}{suffix}")'
+  return CSS_URL.sub(replace, text)
+
+
+def build_file(name, data, built, static_folder):
+  """
+  Writes a file and its compressed copies under its fingerprinted name
+  """
+  built[name] = fingerprinted(name, data)
+  path = os.path.join(static_folder, built[name])
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'wb') as out:
+    out.write(data)
+  if posixpath.splitext(name)[1] not in COMPRESSIBLE:
+    return
+  compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+  if brotli is not None:
+    compressed['.br'] = brotli.compress(data, quality=11)
+  for suffix, variant in compressed.items():
+    if len(variant) < len(data):
+      with open(path + suffix, 'wb') as out:
+        out.write(variant)
+
+
+def build_assets(static_folder):
+  """
+  Builds every static file and bundle, writes the manifest and returns it
+  """
+  built = {}
+  stylesheets = {}
+  for name, path in source_files(static_folder):
+    with open(path, 'rb') as source:
+      data = source.read()
+    extension = posixpath.splitext(name)[1]
+    if extension == '.css':
+      # stylesheets go last, once the files they point at have their names
+      stylesheets[name] = data.decode('utf-8')
+      continue
+    if extension == '.js' and '.min.' not in name:
+      data = minify_js(data.decode('utf-8')).encode('utf-8')
+    build_file(name, data, built, static_folder)
+  for name, text in stylesheets.items():
+    text = rewrite_css_urls(text, name, built)
+    if '.min.' not in name:
+      text = minify_css(text)
+    stylesheets[name] = text
+    build_file(name, text.encode('utf-8'), built, static_folder)
+  for bundle, sources in BUNDLES.items():
+    if bundle.endswith('.css'):
+      text = '\n'.join(stylesheets[source] for source in sources)
+    else:
+      # a semicolon between the scripts keeps one from continuing the other
+      scripts = []
+      for source in sources:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as script:
+          scripts.append(script.read() if '.min.' in source else minify_js(script.read()))
+      text = '\n;'.join(scripts)
+    build_file(bundle, text.encode('utf-8'), built, static_folder)
+  with open(os.path.join(static_folder, BUILD_DIR, 'manifest.json'), 'w') as manifest_file:
+    json.dump(built, manifest_file, indent=2, sort_keys=True)
+  return built
+
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Delete earlier builds first.')
+def build_assets_command(clean):
+  """
+  Fingerprints, bundles, minifies and compresses the files under static/.
+  """
+  build_dir = os.path.join(app.static_folder, BUILD_DIR)
+  if clean and os.path.isdir(build_dir):
+    shutil.rmtree(build_dir)
+  built = build_assets(app.static_folder)
+  for bundle in BUNDLES:
+    sizes = [os.path.getsize(os.path.join(app.static_folder, source)) for source in BUNDLES[bundle]]
+    path = os.path.join(app.static_folder, built[bundle])
+    gzipped = os.path.getsize(path + '.gz') if os.path.exists(path + '.gz') else os.path.getsize(path)
+    click.echo(f'{built[bundle]}: {len(sizes)} files, {sum(sizes)} -> {os.path.getsize(path)} bytes, '
+      f'{gzipped} gzipped')
+  click.echo(f'{len(built)} files built into static/{BUILD_DIR}')
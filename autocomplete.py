@@ -0,0 +1,215 @@
+import threading
+import time
+from app_config import app, db
+from models import Venue, Artist, City, Genre
+
+
+#----------------------------------------------------------------------------#
+# Autocomplete.
+#----------------------------------------------------------------------------#
+# Prefix lookups for the search boxes are answered from an in-process trie
+# over venue, artist, city and genre names. The create, edit and delete
+# handlers in app.py keep it current in the process that served them; like
+# the reference caches, it is rebuilt once AUTOCOMPLETE_TTL seconds have
+# passed or after invalidate(), which picks up writes made by the other
+# workers and the import command. Lookups keep answering from the current
+# trie while one background thread per process rebuilds it, and additions
+# and removals made meanwhile are replayed onto the new trie. Only a
+# process that never loaded it loads it within the request.
+# gunicorn_conf.py invalidates it in each worker after the fork, since the
+# master loaded it during warm-up.
+
+SUGGESTION_MODELS = {
+  'venue': Venue,
+  'artist': Artist,
+  'city': City,
+  'genre': Genre,
+}
+
+
+class TrieNode:
+  __slots__ = ('children', 'entries')
+
+  def __init__(self):
+    self.children = {}
+    self.entries = set()
+
+
+class Trie:
+  """
+  Case-insensitive prefix tree of (kind, id, name) entries.
+  Every name is reachable from its first letter and from the start of each
+  later word, so "jazz" completes "The Jazz Cellar".
+  """
+
+  def __init__(self):
+    self.root = TrieNode()
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def keys(name):
+    """
+    Returns the lowercased name and each of its word-start suffixes
+    """
+    words = (name or '').lower().split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+  def add(self, kind, record_id, name):
+    entry = (kind, record_id, name)
+    with self.lock:
+      for key in self.keys(name):
+        node = self.root
+        for char in key:
+          node = node.children.setdefault(char, TrieNode())
+        node.entries.add(entry)
+
+  def discard(self, kind, record_id, name):
+    entry = (kind, record_id, name)
+    with self.lock:
+      for key in self.keys(name):
+        path = [self.root]
+        for char in key:
+          node = path[-1].children.get(char)
+          if node is None:
+            break
+          path.append(node)
+        else:
+          path[-1].entries.discard(entry)
+          # prune branches left empty by the removal
+          for char, parent, node in zip(reversed(key), reversed(path[:-1]), reversed(path[1:])):
+            if node.entries or node.children:
+              break
+            del parent.children[char]
+
+  def clear(self):
+    with self.lock:
+      self.root = TrieNode()
+
+  def complete(self, prefix, limit=10, kinds=None):
+    """
+    Returns up to limit entries whose name, or a word in it, starts with prefix.
+    Shorter completions come first.
+    """
+    prefix = ' '.join((prefix or '').lower().split())
+    if not prefix:
+      return []
+    results = []
+    seen = set()
+    with self.lock:
+      node = self.root
+      for char in prefix:
+        node = node.children.get(char)
+        if node is None:
+          return []
+      # breadth-first, so shorter completions are found first
+      level = [node]
+      while level and len(results) < limit:
+        next_level = []
+        for current in level:
+          for entry in sorted(current.entries, key=lambda entry: entry[2]):
+            if entry in seen or (kinds and entry[0] not in kinds):
+              continue
+            seen.add(entry)
+            results.append(entry)
+            if len(results) == limit:
+              return results
+          next_level.extend(current.children.values())
+        level = next_level
+    return results
+
+
+class Suggestions(Trie):
+  """
+  The process-wide trie, rebuilt from the database when it is stale
+  """
+
+  def __init__(self):
+    super().__init__()
+    self.version = 0
+    self.loaded_version = None
+    self.loaded_at = 0
+    # held while a rebuild runs, so only one runs at a time
+    self.loading = threading.Lock()
+    # additions and removals made during a rebuild, replayed onto its trie
+    self.pending = None
+    self.refresh = None
+
+  def invalidate(self):
+    self.version += 1
+
+  def is_fresh(self):
+    return (self.loaded_version == self.version
+      and time.monotonic() - self.loaded_at < app.config['AUTOCOMPLETE_TTL'])
+
+  def record(self, change, *entry):
+    with self.lock:
+      if self.pending is not None:
+        self.pending.append((change, entry))
+
+  def add(self, kind, record_id, name):
+    self.record('add', kind, record_id, name)
+    super().add(kind, record_id, name)
+
+  def discard(self, kind, record_id, name):
+    self.record('discard', kind, record_id, name)
+    super().discard(kind, record_id, name)
+
+  def clear(self):
+    super().clear()
+    self.loaded_version = None
+
+  def complete(self, prefix, limit=10, kinds=None):
+    if self.loaded_version is None:
+      with self.loading:
+        if self.loaded_version is None:
+          load_suggestions()
+    elif not self.is_fresh():
+      self.refresh_in_background()
+    return super().complete(prefix, limit, kinds)
+
+  def refresh_in_background(self):
+    """
+    Starts a thread rebuilding the trie, unless one is running already
+    """
+    if not self.loading.acquire(blocking=False):
+      return
+
+    def refresh():
+      try:
+        with app.app_context():
+          load_suggestions()
+      except Exception as error:
+        app.logger.warning(f'Could not reload autocomplete suggestions: {error}')
+      finally:
+        self.loading.release()
+
+    self.refresh = threading.Thread(target=refresh, name='autocomplete-refresh', daemon=True)
+    self.refresh.start()
+
+
+suggestions = Suggestions()
+
+
+def load_suggestions():
+  """
+  Rebuilds the trie from the database, one query per kind
+  """
+  with suggestions.lock:
+    version = suggestions.version
+    suggestions.pending = []
+  trie = Trie()
+  try:
+    for kind, model in SUGGESTION_MODELS.items():
+      for record_id, name in db.session.query(model.id, model.name):
+        trie.add(kind, record_id, name)
+  except Exception:
+    with suggestions.lock:
+      suggestions.pending = None
+    raise
+  with suggestions.lock:
+    for change, entry in suggestions.pending:
+      getattr(trie, change)(*entry)
+    suggestions.pending = None
+    suggestions.root = trie.root
+    suggestions.loaded_version = version
+    suggestions.loaded_at = time.monotonic()
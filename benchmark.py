@@ -0,0 +1,562 @@
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from bisect import bisect
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import accumulate, count, cycle
+import babel.dates
+import click
+import dateutil.parser
+from sqlalchemy import bindparam, event, func
+from sqlalchemy.engine import Engine
+from app_config import app, db
+from models import Venue, Artist, Show, City, State, Genre, Job, genres_venues, genres_artists
+from bulk_import import insert_ignoring_conflicts
+from counters import refresh_show_counters
+from reference import REFERENCE_CACHES
+from formatting import DATETIME_FORMATS, format_datetime, format_datetime_value
+import page_cache
+
+
+#----------------------------------------------------------------------------#
+# Synthetic data.
+#----------------------------------------------------------------------------#
+# `flask seed-data` fills an empty database with the same data for the same
+# seed. Popularity is skewed the way real listings are: a few states hold
+# most cities, a few cities most venues and artists, and a few venues and
+# artists most shows (Zipf weights). Show times are spread a year either
+# side of the day the data is seeded.
+
+STATE_CODES = (
+  'AL AK AZ AR CA CO CT DE DC FL GA HI ID IL IN IA KS KY LA ME MT NE NV NH NJ NM NY NC ND '
+  'OH OK OR MD MA MI MN MS MO PA RI SC SD TN TX UT VT VA WA WV WI WY'
+).split()
+GENRE_NAMES = (
+  'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+  'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+  'Rock n Roll', 'Soul', 'Other',
+)
+CITY_ROOTS = ('Spring', 'River', 'Oak', 'Maple', 'Cedar', 'Lake', 'Fair', 'Green', 'Salem', 'Clin', 'Ash', 'Brook')
+CITY_SUFFIXES = ('field', 'ton', 'ville', 'burg', 'port', 'wood', 'dale', ' Falls', ' Heights', ' Park')
+NAME_WORDS = ('Blue', 'Velvet', 'Golden', 'Electric', 'Silver', 'Midnight', 'Wild', 'Crimson',
+  'Lucky', 'Hollow', 'Neon', 'Painted', 'Iron', 'Broken', 'Royal', 'Lonesome')
+VENUE_NOUNS = ('Room', 'Hall', 'Lounge', 'Tavern', 'Club', 'Theatre', 'Ballroom', 'Cellar', 'Garden')
+ARTIST_NOUNS = ('Horses', 'Kings', 'Rivers', 'Sparrows', 'Saints', 'Wolves', 'Echoes', 'Strangers')
+SEED_BATCH_SIZE = 5000
+
+
+class ZipfPicker:
+  """
+  Picks items with probability proportional to 1 / rank ** exponent
+  """
+
+  def __init__(self, rng, items, exponent=1.1):
+    self.rng = rng
+    self.items = list(items)
+    self.cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(len(self.items))))
+
+  def pick(self):
+    return self.items[bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1])]
+
+  def sample(self, size):
+    picked = []
+    while len(picked) < min(size, len(self.items)):
+      item = self.pick()
+      if item not in picked:
+        picked.append(item)
+    return picked
+
+
+def insert_rows(table, rows):
+  for start in range(0, len(rows), SEED_BATCH_SIZE):
+    db.session.execute(table.insert(), rows[start:start + SEED_BATCH_SIZE])
+
+
+def inserted_ids(model):
+  return [record_id for record_id, in db.session.query(model.id).order_by(model.id)]
+
+
+def seed_data(cities, venues, artists, shows, seed=42, today=None):
+  """
+  Seeds the reference data, then the given numbers of cities, venues,
+  artists and shows. The venue, artist and show tables must be empty.
+  """
+  rng = random.Random(seed)
+  today = today or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+  insert_ignoring_conflicts(State.__table__, [{'name': code} for code in STATE_CODES])
+  insert_ignoring_conflicts(Genre.__table__, [{'name': name} for name in GENRE_NAMES])
+  state_ids = [state_id for state_id, in db.session.query(State.id).order_by(State.id)]
+  genre_ids = [genre_id for genre_id, in db.session.query(Genre.id).order_by(Genre.id)]
+  rng.shuffle(state_ids)
+
+  existing_cities = {name for name, in db.session.query(City.name)}
+  state_picker = ZipfPicker(rng, state_ids)
+  insert_rows(City.__table__, [
+    {'name': name, 'state_id': state_picker.pick()}
+    for name in (f'{rng.choice(CITY_ROOTS)}{rng.choice(CITY_SUFFIXES)} {index}' for index in range(cities))
+    if name not in existing_cities
+  ])
+  city_ids = inserted_ids(City)
+  rng.shuffle(city_ids)
+  city_picker = ZipfPicker(rng, city_ids)
+  genre_picker = ZipfPicker(rng, genre_ids, exponent=0.8)
+
+  insert_rows(Venue.__table__, [{
+    'name': f'The {rng.choice(NAME_WORDS)} {rng.choice(VENUE_NOUNS)} {index}',
+    'address': f'{rng.randint(1, 9999)} {rng.choice(NAME_WORDS)} St',
+    'city_id': city_picker.pick(),
+    'phone': f'{rng.randint(200, 999)}-555-{index:06d}',
+    'image_link': f'https://picsum.photos/seed/venue{index}/600/400',
+    'seeking_talent': rng.random() < 0.3,
+  } for index in range(venues)])
+  insert_rows(Artist.__table__, [{
+    'name': f'The {rng.choice(NAME_WORDS)} {rng.choice(ARTIST_NOUNS)} {index}',
+    'city_id': city_picker.pick(),
+    'phone': f'{rng.randint(200, 999)}-556-{index:06d}',
+    'image_link': f'https://picsum.photos/seed/artist{index}/600/400',
+    'seeking_venue': rng.random() < 0.3,
+  } for index in range(artists)])
+  venue_ids = inserted_ids(Venue)
+  artist_ids = inserted_ids(Artist)
+  insert_rows(genres_venues, [
+    {'venue_id': venue_id, 'genre_id': genre_id}
+    for venue_id in venue_ids for genre_id in genre_picker.sample(rng.randint(1, 3))
+  ])
+  insert_rows(genres_artists, [
+    {'artist_id': artist_id, 'genre_id': genre_id}
+    for artist_id in artist_ids for genre_id in genre_picker.sample(rng.randint(1, 2))
+  ])
+
+  venue_picker = ZipfPicker(rng, venue_ids)
+  artist_picker = ZipfPicker(rng, artist_ids)
+  show_keys = set()
+  while len(show_keys) < shows:
+    start_time = today + timedelta(days=rng.randint(-365, 365), hours=rng.choice((18, 19, 20, 21, 22)))
+    show_keys.add((artist_picker.pick(), venue_picker.pick(), start_time))
+  insert_rows(Show.__table__, [
+    {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start_time}
+    for artist_id, venue_id, start_time in sorted(show_keys)
+  ])
+  refresh_show_counters(Venue)
+  refresh_show_counters(Artist)
+  db.session.commit()
+  for cache in REFERENCE_CACHES.values():
+    cache.invalidate()
+
+
+@app.cli.command('seed-data')
+@click.option('--cities', type=int, default=400, show_default=True)
+@click.option('--venues', type=int, default=2000, show_default=True)
+@click.option('--artists', type=int, default=5000, show_default=True)
+@click.option('--shows', type=int, default=50000, show_default=True)
+@click.option('--seed', type=int, default=42, show_default=True)
+def seed_data_command(cities, venues, artists, shows, seed):
+  """
+  Fills an empty database with deterministic synthetic listings.
+  """
+  if db.session.query(Venue.id).first() or db.session.query(Artist.id).first():
+    raise click.ClickException('seed-data needs a database without venues and artists.')
+  started = time.perf_counter()
+  seed_data(cities, venues, artists, shows, seed)
+  click.echo(f'Seeded {cities} cities, {venues} venues, {artists} artists and {shows} shows '
+    f'in {time.perf_counter() - started:.1f}s.')
+
+
+#----------------------------------------------------------------------------#
+# Benchmarks.
+#----------------------------------------------------------------------------#
+# `flask benchmark` requests every page and API route in turn through the
+# Flask test client, or against a running server with --url using a pool
+# of client threads, and stores latency percentiles, queries per request
+# and throughput as JSON under benchmarks/ so commits can be compared.
+# The edit routes submit records unchanged, and what they still leave
+# behind (updated_at versions and queued jobs) is undone after the run.
+
+BENCHMARK_ROUTES = (
+  ('home', 'GET', '/'),
+  ('venues', 'GET', '/venues'),
+  ('artists', 'GET', '/artists'),
+  ('shows', 'GET', '/shows'),
+  ('upcoming shows', 'GET', '/shows?upcoming=1'),
+  ('venue page', 'GET', '/venues/{venue}'),
+  ('artist page', 'GET', '/artists/{artist}'),
+  ('venue search', 'POST', '/venues/search'),
+  ('artist search', 'POST', '/artists/search'),
+  ('autocomplete', 'GET', '/api/autocomplete?q={prefix}'),
+  ('new venue form', 'GET', '/venues/create'),
+  ('new artist form', 'GET', '/artists/create'),
+  ('new show form', 'GET', '/shows/create'),
+  ('venue edit form', 'GET', '/venues/{venue}/edit'),
+  ('artist edit form', 'GET', '/artists/{artist}/edit'),
+  ('venue edit', 'POST', '/venues/{venue}/edit'),
+  ('artist edit', 'POST', '/artists/{artist}/edit'),
+  ('api venues', 'GET', '/api/v1/venues'),
+  ('api venue', 'GET', '/api/v1/venues/{venue}'),
+  ('api artist', 'GET', '/api/v1/artists/{artist}'),
+  ('api shows', 'GET', '/api/v1/shows?limit=200'),
+)
+
+# jobs queued by the venue and artist edit handlers
+EDIT_JOB_KINDS = ('touch_venue_artists', 'touch_artist_venues')
+
+
+def percentile(sorted_values, percent):
+  """
+  Nearest-rank percentile of an already sorted list
+  """
+  if not sorted_values:
+    return None
+  return sorted_values[max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(samples, seconds):
+  """
+  Returns the statistics of [(latency seconds, queries or None)]
+  """
+  latencies = sorted(latency * 1000 for latency, queries in samples)
+  queries = [queries for latency, queries in samples if queries is not None]
+  return {
+    'requests': len(samples),
+    'p50_ms': round(percentile(latencies, 50), 3),
+    'p95_ms': round(percentile(latencies, 95), 3),
+    'p99_ms': round(percentile(latencies, 99), 3),
+    'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    'throughput_rps': round(len(samples) / seconds, 1) if seconds else None,
+  }
+
+
+def benchmark_targets(rng, size=50):
+  """
+  Returns the ids, search terms and prefixes requests are made for, drawn
+  from the busiest records and the long tail alike
+  """
+  busiest_venues = [record_id for record_id, in db.session.query(Venue.id).order_by(
+    Venue.upcoming_shows_count.desc(), Venue.id).limit(size // 2)]
+  busiest_artists = [record_id for record_id, in db.session.query(Artist.id).order_by(
+    Artist.upcoming_shows_count.desc(), Artist.id).limit(size // 2)]
+  venue_ids = inserted_ids(Venue)
+  artist_ids = inserted_ids(Artist)
+  if not venue_ids or not artist_ids:
+    raise click.ClickException('The database has no venues or artists; run flask seed-data first.')
+  venues = busiest_venues + rng.sample(venue_ids, min(size // 2, len(venue_ids)))
+  artists = busiest_artists + rng.sample(artist_ids, min(size // 2, len(artist_ids)))
+  names = [name for name, in db.session.query(Artist.name).filter(Artist.id.in_(artists))]
+  words = [word for name in names for word in name.split() if len(word) > 3]
+  return {
+    'venue': venues,
+    'artist': artists,
+    'term': words,
+    'prefix': [word[:3].lower() for word in words],
+  }
+
+
+def edit_form(model, record_id):
+  """
+  Returns form data that submits a venue or artist unchanged, with every
+  field of its edit form, as a browser sends it
+  """
+  record = model.query.get(record_id)
+  data = {
+    key: getattr(record, key) or ''
+    for key in ('name', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_description')
+  }
+  data.update({
+    'city': record.city.name,
+    'state': record.city.state.name,
+    'genres': [genre.name for genre in record.genres],
+  })
+  if model is Venue:
+    data['address'] = record.address
+  return data
+
+
+@contextmanager
+def undoing_edits():
+  """
+  Restores the updated_at of every venue and artist when the block ends and
+  deletes the edit jobs queued meanwhile. Stop `flask work-jobs` while
+  benchmarking, or it may run those jobs before they are deleted.
+  """
+  last_job_id = db.session.query(func.max(Job.id)).scalar() or 0
+  versions = {model: dict(db.session.query(model.id, model.updated_at)) for model in (Venue, Artist)}
+  db.session.commit()
+  try:
+    yield
+  finally:
+    db.session.rollback()
+    db.session.query(Job).filter(Job.id > last_job_id, Job.kind.in_(EDIT_JOB_KINDS)).delete(
+      synchronize_session=False)
+    for model, before in versions.items():
+      changed = [
+        {'record_id': record_id, 'version': before[record_id]}
+        for record_id, updated_at in db.session.query(model.id, model.updated_at)
+        if record_id in before and updated_at != before[record_id]
+      ]
+      if changed:
+        table = model.__table__
+        db.session.execute(table.update().where(table.c.id == bindparam('record_id')).values(
+          updated_at=bindparam('version')), changed)
+    db.session.commit()
+
+
+def benchmark_requests(targets):
+  """
+  Yields (route name, method, url, form data) forever, cycling through the
+  routes and the targets
+  """
+  positions = count()
+  while True:
+    position = next(positions)
+    for name, method, url in BENCHMARK_ROUTES:
+      values = {key: items[position % len(items)] for key, items in targets.items()}
+      url = url.format(**values)
+      data = None
+      if name.endswith('search'):
+        data = {'search_term': values['term']}
+      elif name == 'venue edit':
+        data = edit_form(Venue, values['venue'])
+      elif name == 'artist edit':
+        data = edit_form(Artist, values['artist'])
+      yield name, method, url, data
+
+
+def run_in_process(requests_per_route, targets, warmup=3):
+  """
+  Times each route through the test client, counting its queries
+  """
+  client = app.test_client()
+  samples = defaultdict(list)
+  statements = []
+
+  def record(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  requests = benchmark_requests(targets)
+  for name, method, url, data in [next(requests) for _ in range(warmup * len(BENCHMARK_ROUTES))]:
+    client.open(url, method=method, data=data)
+  event.listen(Engine, 'before_cursor_execute', record)
+  started = time.perf_counter()
+  try:
+    for _ in range(requests_per_route * len(BENCHMARK_ROUTES)):
+      name, method, url, data = next(requests)
+      statements.clear()
+      request_started = time.perf_counter()
+      response = client.open(url, method=method, data=data)
+      samples[name].append((time.perf_counter() - request_started, len(statements)))
+      if response.status_code >= 400:
+        raise click.ClickException(f'{method} {url} answered {response.status_code}.')
+  finally:
+    event.remove(Engine, 'before_cursor_execute', record)
+  return samples, time.perf_counter() - started
+
+
+def server_timing_queries(header):
+  """
+  Returns the query count of a Server-Timing header set by the profiler
+  """
+  if header and 'desc="' in header:
+    return int(header.split('desc="')[1].split()[0])
+  return None
+
+
+def run_over_http(base_url, duration, concurrency, targets):
+  """
+  Sends the route mix to a running server from concurrency threads for
+  duration seconds
+  """
+  requests = [request for request, _ in zip(
+    benchmark_requests(targets), range(len(targets['venue']) * len(BENCHMARK_ROUTES)))]
+  requests = cycle(requests)
+  lock = threading.Lock()
+  samples = defaultdict(list)
+  failures = []
+  deadline = time.perf_counter() + duration
+
+  def worker():
+    while time.perf_counter() < deadline:
+      with lock:
+        name, method, url, data = next(requests)
+      body = urllib.parse.urlencode(data, doseq=True).encode('utf-8') if data else None
+      http_request = urllib.request.Request(base_url.rstrip('/') + url, data=body, method=method)
+      started = time.perf_counter()
+      try:
+        with urllib.request.urlopen(http_request, timeout=30) as response:
+          response.read()
+          queries = server_timing_queries(response.headers.get('Server-Timing'))
+      except (urllib.error.URLError, OSError) as error:
+        failures.append(f'{method} {url}: {error}')
+        continue
+      with lock:
+        samples[name].append((time.perf_counter() - started, queries))
+
+  started = time.perf_counter()
+  with ThreadPoolExecutor(concurrency) as pool:
+    for _ in range(concurrency):
+      pool.submit(worker)
+  if failures:
+    click.echo(f'{len(failures)} requests failed, e.g. {failures[0]}', err=True)
+  return samples, time.perf_counter() - started
+
+
+def git_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+      cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def compare_results(baseline, results, threshold):
+  """
+  Returns the routes whose p95 grew by more than threshold percent
+  """
+  regressions = []
+  for name, stats in results['routes'].items():
+    before = baseline['routes'].get(name)
+    if not before or not before['p95_ms']:
+      continue
+    change = 100 * (stats['p95_ms'] - before['p95_ms']) / before['p95_ms']
+    click.echo(f"{name:18} p95 {before['p95_ms']:9.2f} -> {stats['p95_ms']:9.2f} ms ({change:+.0f}%)")
+    if change > threshold:
+      regressions.append(name)
+  return regressions
+
+
+@app.cli.command('benchmark')
+@click.option('--requests', 'requests_per_route', type=int, default=100, show_default=True,
+  help='Timed requests per route, in process.')
+@click.option('--url', default=None, help='Load a running server instead, e.g. http://localhost:8000')
+@click.option('--duration', type=float, default=30, show_default=True, help='Seconds of load with --url.')
+@click.option('--concurrency', type=int, default=8, show_default=True, help='Client threads with --url.')
+@click.option('--page-cache/--no-page-cache', 'use_page_cache', default=False, show_default=True,
+  help='Serve cached pages in process.')
+@click.option('--seed', type=int, default=42, show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None,
+  help='Defaults to benchmarks/<commit>.json.')
+@click.option('--compare', type=click.File('r'), default=None, help='Earlier results to compare with.')
+@click.option('--threshold', type=float, default=20, show_default=True,
+  help='p95 growth in percent that counts as a regression.')
+def benchmark_command(requests_per_route, url, duration, concurrency, use_page_cache, seed, output,
+    compare, threshold):
+  """
+  Measures latency, queries per request and throughput of every route.
+  """
+  targets = benchmark_targets(random.Random(seed))
+  if url:
+    with undoing_edits():
+      samples, seconds = run_over_http(url, duration, concurrency, targets)
+  else:
+    app.config['WTF_CSRF_ENABLED'] = False
+    cache = page_cache.page_cache
+    if not use_page_cache:
+      page_cache.page_cache = None
+    try:
+      with undoing_edits():
+        samples, seconds = run_in_process(requests_per_route, targets)
+    finally:
+      page_cache.page_cache = cache
+
+  commit = git_commit()
+  results = {
+    'commit': commit,
+    'created': datetime.now().isoformat(timespec='seconds'),
+    'database': db.engine.dialect.name,
+    'mode': 'http' if url else 'in-process',
+    'concurrency': concurrency if url else 1,
+    'page_cache': None if url else use_page_cache,
+    'data': {model.__name__.lower(): model.query.count() for model in (City, Venue, Artist, Show)},
+    'total': summarize([sample for route in samples.values() for sample in route], seconds),
+    'routes': {name: summarize(samples[name], sum(latency for latency, queries in samples[name]))
+      for name, method, path in BENCHMARK_ROUTES if samples[name]},
+  }
+  for name, stats in results['routes'].items():
+    queries = stats['queries_per_request']
+    click.echo(f"{name:18} p50 {stats['p50_ms']:8.2f}  p95 {stats['p95_ms']:8.2f}  "
+      f"p99 {stats['p99_ms']:8.2f} ms  {'-' if queries is None else queries:>5} queries")
+  click.echo(f"total: {results['total']['requests']} requests, {results['total']['throughput_rps']} req/s")
+
+  output = output or os.path.join('benchmarks', f"{commit or 'results'}.json")
+  os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+  with open(output, 'w') as results_file:
+    json.dump(results, results_file, indent=2)
+  click.echo(f'Results written to {output}')
+
+  if compare is not None:
+    regressions = compare_results(json.load(compare), results, threshold)
+    if regressions:
+      raise click.ClickException(f"p95 regressed over {threshold:.0f}% on: {', '.join(regressions)}")
+
+
+#----------------------------------------------------------------------------#
+# Date formatting benchmark.
+#----------------------------------------------------------------------------#
+# `flask benchmark-datetime` times the `datetime` template filter over the
+# show times of one large page against the way it used to format them:
+# each datetime turned into a string, parsed back with dateutil and handed
+# to Babel with its pattern.
+
+def format_datetime_before(value, format):
+  """
+  The filter as it was before formatting.py
+  """
+  date = dateutil.parser.parse(str(value))
+  return babel.dates.format_datetime(date, DATETIME_FORMATS.get(format, format))
+
+
+def microseconds_per_value(format_value, values, rounds, before_round=None):
+  """
+  Returns the best of rounds of formatting every value, in microseconds per value
+  """
+  best = None
+  for _ in range(rounds):
+    if before_round is not None:
+      before_round()
+    started = time.perf_counter()
+    for value in values:
+      format_value(value)
+    elapsed = time.perf_counter() - started
+    best = elapsed if best is None else min(best, elapsed)
+  return best / len(values) * 1e6
+
+
+@app.cli.command('benchmark-datetime')
+@click.option('--values', 'value_count', type=int, default=500, show_default=True,
+  help='Show times formatted per round, as on one page.')
+@click.option('--rounds', type=int, default=20, show_default=True)
+@click.option('--format', 'format_name', default='full', show_default=True)
+@click.option('--seed', type=int, default=42, show_default=True)
+def benchmark_datetime_command(value_count, rounds, format_name, seed):
+  """
+  Compares the datetime template filter with the way it used to work.
+  """
+  rng = random.Random(seed)
+  today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+  values = [today + timedelta(days=rng.randrange(-365, 365), hours=rng.choice((18, 19, 20, 21)),
+    minutes=rng.choice((0, 30))) for _ in range(value_count)]
+  for value in values:
+    if format_datetime(value, format_name) != format_datetime_before(value, format_name):
+      raise click.ClickException(f'Formats differ for {value!r}')
+
+  timings = {
+    'before (str -> dateutil -> babel)': microseconds_per_value(
+      lambda value: format_datetime_before(value, format_name), values, rounds),
+    'datetime filter, cold cache': microseconds_per_value(
+      lambda value: format_datetime(value, format_name), values, rounds,
+      before_round=format_datetime_value.cache_clear),
+    'datetime filter, warm cache': microseconds_per_value(
+      lambda value: format_datetime(value, format_name), values, rounds),
+  }
+  before = timings['before (str -> dateutil -> babel)']
+  for name, microseconds in timings.items():
+    click.echo(f'{name:34} {microseconds:8.2f} us/value  {microseconds * value_count / 1000:7.2f} ms/page  '
+      f'{before / microseconds:6.1f}x')
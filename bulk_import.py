@@ -0,0 +1,346 @@
+import csv
+import json
+from itertools import islice
+import click
+import dateutil.parser
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SQLAlchemyError
+from app_config import app, db
+from models import Venue, Artist, Show, City, genres_venues, genres_artists
+from reference import states, genres
+from counters import refresh_show_counters
+from conditional import touch
+
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+# `flask import-data <venues|artists|shows> <file>` streams a CSV or JSONL
+# file in batches. Each batch resolves its cities and genres with a couple
+# of queries and loads its rows with one multi-row INSERT that skips rows
+# conflicting with a unique constraint. Rows that cannot be loaded are
+# reported with their line number and the run carries on.
+
+ENTITY_IMPORTS = {
+  'venues': {
+    'model': Venue,
+    'genre_table': genres_venues,
+    'owner_key': 'venue_id',
+    'columns': ('name', 'address', 'phone', 'image_link', 'facebook_link',
+      'website', 'seeking_talent', 'seeking_description'),
+    'required': ('name', 'address', 'city', 'state'),
+    'key': ('name', 'address', 'city_id'),
+  },
+  'artists': {
+    'model': Artist,
+    'genre_table': genres_artists,
+    'owner_key': 'artist_id',
+    'columns': ('name', 'phone', 'image_link', 'facebook_link', 'website',
+      'seeking_venue', 'seeking_description'),
+    'required': ('name', 'city', 'state'),
+    'key': ('name',),
+  },
+}
+
+BOOLEAN_COLUMNS = ('seeking_talent', 'seeking_venue')
+
+
+class RowRejected(Exception):
+  pass
+
+
+class BatchOutcome:
+  """
+  Rows loaded and rejected by one batch, kept until the batch commits
+  """
+
+  def __init__(self):
+    self.loaded = 0
+    self.rejects = []
+
+  def reject(self, line, reason, row):
+    self.rejects.append((line, reason, row))
+
+
+class ImportReport:
+  """
+  Counts loaded rows and reports rejected ones over a whole import
+  """
+
+  def __init__(self, rejects_file=None):
+    self.loaded = 0
+    self.rejected = 0
+    self.rejects_file = rejects_file
+
+  def reject(self, line, reason, row):
+    self.rejected += 1
+    if self.rejects_file is not None:
+      self.rejects_file.write(json.dumps({'line': line, 'reason': reason, 'row': row}) + '\n')
+    else:
+      click.echo(f'line {line}: {reason}', err=True)
+
+  def add(self, outcome):
+    self.loaded += outcome.loaded
+    for reject in outcome.rejects:
+      self.reject(*reject)
+
+
+def read_rows(path, report):
+  """
+  Yields (line number, row dict) from a .csv or .jsonl file. JSONL lines
+  that are not a JSON object are rejected to the report and skipped.
+  """
+  with open(path, newline='', encoding='utf-8') as source:
+    if path.endswith('.csv'):
+      reader = csv.DictReader(source)
+      for row in reader:
+        yield reader.line_num, row
+    else:
+      for line, text in enumerate(source, start=1):
+        if not text.strip():
+          continue
+        try:
+          row = json.loads(text)
+        except ValueError as error:
+          report.reject(line, f'invalid JSON: {error}', text.rstrip('\r\n'))
+          continue
+        if not isinstance(row, dict):
+          report.reject(line, 'not a JSON object', row)
+          continue
+        yield line, row
+
+
+def batches(rows, size):
+  rows = iter(rows)
+  while True:
+    batch = list(islice(rows, size))
+    if not batch:
+      return
+    yield batch
+
+
+def parse_bool(value):
+  if isinstance(value, bool):
+    return value
+  return str(value or '').strip().lower() in ('1', 'y', 'yes', 'true')
+
+
+def parse_genres(value):
+  """
+  Returns genre names from a JSON list or a ;-separated CSV cell
+  """
+  if isinstance(value, list):
+    names = value
+  else:
+    names = str(value or '').split(';')
+  return [name.strip() for name in names if name and name.strip()]
+
+
+def insert_ignoring_conflicts(table, rows):
+  """
+  Inserts rows with one multi-row INSERT, skipping rows that violate a
+  unique constraint
+  """
+  if not rows:
+    return
+  if db.engine.dialect.name == 'postgresql':
+    statement = postgresql.insert(table).values(rows).on_conflict_do_nothing()
+  else:
+    statement = table.insert().values(rows).prefix_with('OR IGNORE')
+  db.session.execute(statement)
+
+
+def resolve_cities(pairs):
+  """
+  Returns {lowercased city name: id} for (city, state) pairs, inserting the
+  missing cities in one statement. Cities in unknown states are left out.
+  """
+  wanted = {city.lower(): (city, state) for city, state in pairs}
+  if not wanted:
+    return {}
+
+  def known():
+    return dict(db.session.query(func.lower(City.name), City.id).filter(
+      func.lower(City.name).in_(list(wanted))))
+
+  city_ids = known()
+  missing = [
+    {'name': city, 'state_id': states.id_for(state)}
+    for key, (city, state) in wanted.items()
+    if key not in city_ids and states.id_for(state) is not None
+  ]
+  if missing:
+    insert_ignoring_conflicts(City.__table__, missing)
+    city_ids = known()
+  return city_ids
+
+
+def prepare_entity(config, row):
+  """
+  Returns the column values, genre ids and (city, state) of a venue or
+  artist row
+  """
+  for field in config['required']:
+    if not str(row.get(field) or '').strip():
+      raise RowRejected(f'missing {field}')
+  # JSON rows can hold numbers where text belongs
+  place = (str(row['city']).strip(), str(row['state']).strip())
+  values = {}
+  for column in config['columns']:
+    value = row.get(column)
+    if column in BOOLEAN_COLUMNS:
+      value = parse_bool(value)
+    elif isinstance(value, str):
+      value = value.strip() or None
+    values[column] = value
+  genre_ids = []
+  for name in parse_genres(row.get('genres')):
+    genre_id = genres.id_for(name)
+    if genre_id is None:
+      raise RowRejected(f'unknown genre {name}')
+    genre_ids.append(genre_id)
+  return values, genre_ids, place
+
+
+def load_entities(kind, batch, outcome):
+  """
+  Loads a batch of venue or artist rows
+  """
+  config = ENTITY_IMPORTS[kind]
+  model = config['model']
+  prepared = []
+  for line, row in batch:
+    try:
+      prepared.append((line, row) + prepare_entity(config, row))
+    except RowRejected as error:
+      outcome.reject(line, str(error), row)
+  if not prepared:
+    return
+
+  city_ids = resolve_cities({place for line, row, values, genre_ids, place in prepared})
+  key_columns = [getattr(model, column) for column in config['key']]
+  names = [values['name'] for line, row, values, genre_ids, place in prepared]
+  existing = {tuple(key) for key in db.session.query(*key_columns).filter(model.name.in_(names))}
+
+  to_insert = {}
+  for line, row, values, genre_ids, (city, state) in prepared:
+    values['city_id'] = city_ids.get(city.lower())
+    if values['city_id'] is None:
+      outcome.reject(line, f'unknown state {state}', row)
+      continue
+    key = tuple(values[column] for column in config['key'])
+    if key in existing or key in to_insert:
+      outcome.reject(line, f'duplicate {kind[:-1]}', row)
+      continue
+    to_insert[key] = (line, row, values, genre_ids)
+
+  insert_ignoring_conflicts(model.__table__, [values for line, row, values, genre_ids in to_insert.values()])
+  inserted = {
+    tuple(key[:-1]): key[-1] for key in
+    db.session.query(*key_columns, model.id).filter(model.name.in_([key[0] for key in to_insert]))
+  }
+  links = []
+  for key, (line, row, values, genre_ids) in to_insert.items():
+    record_id = inserted.get(key)
+    if record_id is None:
+      outcome.reject(line, f'conflicts with an existing {kind[:-1]}', row)
+      continue
+    links.extend({config['owner_key']: record_id, 'genre_id': genre_id} for genre_id in set(genre_ids))
+    outcome.loaded += 1
+  insert_ignoring_conflicts(config['genre_table'], links)
+
+
+def prepare_show(row):
+  try:
+    return {
+      'artist_id': int(row.get('artist_id')),
+      'venue_id': int(row.get('venue_id')),
+      'start_time': dateutil.parser.parse(str(row.get('start_time'))),
+    }
+  except (TypeError, ValueError, OverflowError) as error:
+    raise RowRejected(f'invalid show: {error}')
+
+
+def load_shows(batch, outcome):
+  """
+  Loads a batch of show rows and refreshes the counters they change
+  """
+  prepared = []
+  for line, row in batch:
+    try:
+      prepared.append((line, row, prepare_show(row)))
+    except RowRejected as error:
+      outcome.reject(line, str(error), row)
+  if not prepared:
+    return
+
+  artist_ids = {values['artist_id'] for line, row, values in prepared}
+  venue_ids = {values['venue_id'] for line, row, values in prepared}
+  known_artists = {artist_id for artist_id, in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids))}
+  known_venues = {venue_id for venue_id, in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))}
+  existing = set(db.session.query(Show.artist_id, Show.venue_id, Show.start_time).filter(
+    Show.artist_id.in_(artist_ids), Show.venue_id.in_(venue_ids)))
+
+  to_insert = {}
+  for line, row, values in prepared:
+    key = (values['artist_id'], values['venue_id'], values['start_time'])
+    if values['artist_id'] not in known_artists:
+      outcome.reject(line, f"unknown artist {values['artist_id']}", row)
+    elif values['venue_id'] not in known_venues:
+      outcome.reject(line, f"unknown venue {values['venue_id']}", row)
+    elif key in existing or key in to_insert:
+      outcome.reject(line, 'duplicate show', row)
+    else:
+      to_insert[key] = values
+  insert_ignoring_conflicts(Show.__table__, list(to_insert.values()))
+  outcome.loaded += len(to_insert)
+
+  loaded_venues = {values['venue_id'] for values in to_insert.values()}
+  loaded_artists = {values['artist_id'] for values in to_insert.values()}
+  refresh_show_counters(Venue, loaded_venues)
+  refresh_show_counters(Artist, loaded_artists)
+  touch(Venue, loaded_venues)
+  touch(Artist, loaded_artists)
+
+
+def load_batch(kind, batch, report):
+  """
+  Loads and commits one batch. When the database refuses the batch, its
+  rows are retried one at a time so only the offending rows are rejected.
+  """
+  outcome = BatchOutcome()
+  try:
+    if kind == 'shows':
+      load_shows(batch, outcome)
+    else:
+      load_entities(kind, batch, outcome)
+    db.session.commit()
+  except SQLAlchemyError as error:
+    db.session.rollback()
+    if len(batch) == 1:
+      line, row = batch[0]
+      report.reject(line, str(error.orig if hasattr(error, 'orig') else error).strip(), row)
+      return
+    for line_row in batch:
+      load_batch(kind, [line_row], report)
+    return
+  report.add(outcome)
+
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+@click.option('--rejects', type=click.File('w'), default=None,
+  help='Write rejected rows to this JSONL file instead of stderr.')
+def import_data_command(kind, path, batch_size, rejects):
+  """
+  Loads venues, artists or shows from a .csv or .jsonl file.
+  Genres are ;-separated in CSV files and lists in JSONL files.
+  """
+  report = ImportReport(rejects)
+  for batch in batches(read_rows(path, report), batch_size):
+    load_batch(kind, batch, report)
+    click.echo(f'{report.loaded} loaded, {report.rejected} rejected', err=True)
+  click.echo(f'Imported {report.loaded} {kind}; {report.rejected} rows rejected.')
@@ -0,0 +1,85 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, session, abort, make_response
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Query
+from app_config import db
+from models import Venue, Artist, Show
+from counters import OWNER_COLUMNS
+
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+# Venue, Artist and Show carry an updated_at version. A detail page changes
+# when its row changes, when a row on the other side of one of its shows
+# changes, or when one of its shows moves from upcoming to past. The write
+# handlers touch their own row and queue a job that touches the rows on
+# the other side (see jobs.py), so the first two cases bump the page's own
+# updated_at. The third is caught by the start of its latest past show.
+# Together they are the validator of a page, read in one indexed lookup
+# before the page is built.
+
+def touch(model, ids):
+  """
+  Bumps the updated_at version of the given venues, artists or shows.
+  ids is a list of ids or a query selecting them.
+  """
+  if not isinstance(ids, Query):
+    ids = list(ids)
+    if not ids:
+      return
+  model.query.filter(model.id.in_(ids)).update(
+    {model.updated_at: datetime.now()}, synchronize_session=False)
+
+
+def entity_version(model, entity_id):
+  """
+  Returns (updated_at, start of the latest past show) of a venue or artist,
+  or None when it does not exist
+  """
+  latest_past_show = select([func.max(Show.start_time)]).where(and_(
+    OWNER_COLUMNS[model] == model.id,
+    Show.start_time < datetime.now()
+  )).as_scalar()
+  return db.session.query(model.updated_at, latest_past_show).filter(
+    model.id == entity_id).first()
+
+
+def conditional(model, id_arg):
+  """
+  Answers 304 Not Modified for a detail view when the client's copy of the
+  page is current, without running the view. Otherwise the view's response
+  gets ETag and Last-Modified validators.
+  """
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      if session.get('_flashes'):
+        return view(*args, **kwargs)
+      version = entity_version(model, kwargs[id_arg])
+      if version is None:
+        abort(404)
+      etag = hashlib.sha1(repr(tuple(version)).encode('utf-8')).hexdigest()
+      # naive datetimes in this app are local time
+      last_modified = max(value for value in version if value is not None)
+      last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+
+      modified_since = request.if_modified_since
+      if modified_since is not None and modified_since.tzinfo is None:
+        modified_since = modified_since.replace(tzinfo=timezone.utc)
+      if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+      else:
+        not_modified = modified_since is not None and last_modified <= modified_since
+      if not_modified:
+        response = make_response('', 304)
+      else:
+        response = make_response(view(*args, **kwargs))
+      response.set_etag(etag)
+      response.last_modified = last_modified
+      response.headers['Cache-Control'] = 'no-cache'
+      return response
+    return wrapper
+  return decorator
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import and_, func, select
+from app_config import app, db
+from models import Venue, Artist, Show
+
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+# Venue and Artist carry past_shows_count and upcoming_shows_count so that
+# listing pages can show them without reading the Show table. The counters
+# are recomputed for the affected rows whenever shows are written, and a
+# scheduled job refreshes the rows whose shows have since started.
+
+OWNER_COLUMNS = {
+  Venue: Show.venue_id,
+  Artist: Show.artist_id,
+}
+
+
+def refresh_show_counters(model, ids=None, now=None):
+  """
+  Recomputes the show counters of the given venue or artist ids.
+  All rows are refreshed when ids is None. The counts are correlated
+  subqueries of a single UPDATE statement.
+  """
+  now = now or datetime.now()
+  owner_column = OWNER_COLUMNS[model]
+
+  def count(time_filter):
+    return select([func.count(Show.id)]).where(
+      and_(owner_column == model.id, time_filter)).as_scalar()
+
+  query = model.query
+  if ids is not None:
+    ids = list(ids)
+    if not ids:
+      return
+    query = query.filter(model.id.in_(ids))
+  query.update({
+    model.past_shows_count: count(Show.start_time < now),
+    model.upcoming_shows_count: count(Show.start_time >= now),
+  }, synchronize_session=False)
+
+
+def refresh_started_show_counters(since, now=None):
+  """
+  Refreshes the counters of venues and artists with a show that started
+  between since and now, i.e. that moved from upcoming to past.
+  Returns the number of venues and artists refreshed.
+  """
+  now = now or datetime.now()
+  started = db.session.query(Show.venue_id, Show.artist_id).filter(
+    Show.start_time >= since, Show.start_time < now).all()
+  venue_ids = {venue_id for venue_id, artist_id in started}
+  artist_ids = {artist_id for venue_id, artist_id in started}
+  refresh_show_counters(Venue, venue_ids, now)
+  refresh_show_counters(Artist, artist_ids, now)
+  return len(venue_ids), len(artist_ids)
+
+
+@app.cli.command('refresh-show-counters')
+@click.option('--minutes', type=int, default=None,
+  help='Only refresh rows with shows that started in the last N minutes.')
+def refresh_show_counters_command(minutes):
+  """
+  Moves shows that have started from the upcoming to the past counters.
+  Run it from cron with --minutes a little above the cron interval; without
+  --minutes every venue and artist is recomputed.
+  """
+  now = datetime.now()
+  if minutes is None:
+    refresh_show_counters(Venue, now=now)
+    refresh_show_counters(Artist, now=now)
+    click.echo('Refreshed all show counters.')
+  else:
+    venues, artists = refresh_started_show_counters(now - timedelta(minutes=minutes), now)
+    click.echo(f'Refreshed show counters of {venues} venues and {artists} artists.')
+  db.session.commit()
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import deque
+from flask import current_app, has_request_context
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+#----------------------------------------------------------------------------#
+# Connection pool.
+#----------------------------------------------------------------------------#
+# PostgreSQL engines get their pool settings from the DB_POOL_* config and
+# a pool that records how long each checkout waited, how often it had to
+# open an overflow connection and how often it timed out. In PgBouncer mode
+# PgBouncer does the pooling and connections are opened per checkout.
+#
+# DB_STATEMENT_TIMEOUT_MS only limits web requests: their transactions
+# start with SET LOCAL statement_timeout, which also works through
+# PgBouncer. CLI commands and background jobs run without a request, so
+# imports and counter refreshes are not cancelled halfway.
+
+class PoolMetrics:
+  """
+  Checkout counters of this process' pool
+  """
+
+  def __init__(self, window=1000):
+    self.lock = threading.Lock()
+    self.waits = deque(maxlen=window)
+    self.checkouts = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+    self.overflow_events = 0
+    self.timeouts = 0
+
+  def record_checkout(self, wait, overflowed):
+    with self.lock:
+      self.checkouts += 1
+      self.total_wait += wait
+      self.max_wait = max(self.max_wait, wait)
+      self.waits.append(wait)
+      if overflowed:
+        self.overflow_events += 1
+
+  def record_timeout(self):
+    with self.lock:
+      self.timeouts += 1
+
+  def stats(self):
+    with self.lock:
+      waits = sorted(self.waits)
+      return {
+        'checkouts': self.checkouts,
+        'overflow_events': self.overflow_events,
+        'timeouts': self.timeouts,
+        'wait_ms': {
+          'mean': round(1000 * self.total_wait / self.checkouts, 3) if self.checkouts else 0,
+          'p95': round(1000 * waits[int(len(waits) * 0.95)], 3) if waits else 0,
+          'max': round(1000 * self.max_wait, 3),
+        },
+      }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedPoolMixin:
+  """
+  Times each checkout from the pool, including opening a new connection
+  """
+
+  def _do_get(self):
+    overflow_before = self._overflow if isinstance(self, QueuePool) else 0
+    started = time.perf_counter()
+    try:
+      connection = super()._do_get()
+    except PoolTimeoutError:
+      pool_metrics.record_timeout()
+      raise
+    # _overflow counts connections beyond pool_size, negative while below it
+    overflowed = isinstance(self, QueuePool) and self._overflow > max(overflow_before, 0)
+    pool_metrics.record_checkout(time.perf_counter() - started, overflowed)
+    return connection
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+  pass
+
+
+class InstrumentedNullPool(InstrumentedPoolMixin, NullPool):
+  pass
+
+
+def pool_options(config):
+  """
+  Returns the create_engine() options of a PostgreSQL engine
+  """
+  if config['DB_PGBOUNCER']:
+    return {'poolclass': InstrumentedNullPool, 'pool_pre_ping': False}
+  options = {
+    'poolclass': InstrumentedQueuePool,
+    'pool_size': config['DB_POOL_SIZE'],
+    'max_overflow': config['DB_MAX_OVERFLOW'],
+    'pool_timeout': config['DB_POOL_TIMEOUT'],
+    'pool_recycle': config['DB_POOL_RECYCLE'],
+    'pool_pre_ping': config['DB_POOL_PRE_PING'],
+  }
+  return options
+
+
+def limit_request_statements(connection):
+  """
+  Sets the statement timeout of a transaction begun while serving a request
+  """
+  if not has_request_context():
+    return
+  timeout = current_app.config['DB_STATEMENT_TIMEOUT_MS']
+  if timeout:
+    # straight through the DBAPI, so query profiles and budgets leave it out
+    cursor = connection.connection.cursor()
+    try:
+      cursor.execute(f'SET LOCAL statement_timeout = {int(timeout)}')
+    finally:
+      cursor.close()
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+  """
+  SQLAlchemy extension applying the DB_POOL_* settings to PostgreSQL engines
+  """
+
+  def apply_driver_hacks(self, app, sa_url, options):
+    super().apply_driver_hacks(app, sa_url, options)
+    if sa_url.drivername.startswith('postgresql'):
+      options.update(pool_options(app.config))
+
+  def create_engine(self, sa_url, engine_opts):
+    engine = super().create_engine(sa_url, engine_opts)
+    if engine.dialect.name == 'postgresql':
+      event.listen(engine, 'begin', limit_request_statements)
+    return engine
+
+
+def make_psycopg2_green():
+  """
+  Makes psycopg2 yield to other greenlets while it waits on PostgreSQL, so
+  one gevent worker overlaps the queries of many requests. Call it once,
+  after gevent has monkey-patched the process.
+  """
+  try:
+    import psycopg2
+  except ImportError:
+    return
+  from psycopg2 import extensions
+  from gevent.socket import wait_read, wait_write
+
+  def wait_callback(connection, timeout=None):
+    while True:
+      state = connection.poll()
+      if state == extensions.POLL_OK:
+        return
+      if state == extensions.POLL_READ:
+        wait_read(connection.fileno(), timeout=timeout)
+      elif state == extensions.POLL_WRITE:
+        wait_write(connection.fileno(), timeout=timeout)
+      else:
+        raise psycopg2.OperationalError(f'Bad result from poll: {state!r}')
+
+  extensions.set_wait_callback(wait_callback)
+
+
+def pool_stats(engine):
+  """
+  Returns the live state of an engine's pool and its checkout counters
+  """
+  pool = engine.pool
+  stats = {'pool': type(pool).__name__}
+  if isinstance(pool, QueuePool):
+    stats.update({
+      'size': pool.size(),
+      'checked_out': pool.checkedout(),
+      'checked_in': pool.checkedin(),
+      'overflow': max(pool.overflow(), 0),
+    })
+  stats.update(pool_metrics.stats())
+  return stats
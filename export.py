@@ -0,0 +1,228 @@
+import csv
+import io
+from itertools import islice
+import click
+from flask import Response, request, stream_with_context
+from sqlalchemy import Boolean, DateTime, Integer, func
+from app_config import app, db
+from models import Venue, Artist, Show, City, State, Genre, genres_venues, genres_artists
+from api import APIError, dumps
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+
+#----------------------------------------------------------------------------#
+# Bulk export.
+#----------------------------------------------------------------------------#
+# Venues, artists and shows are exported with their city, state and genre
+# names joined in, as CSV, JSONL or Parquet. Rows are read through a
+# server-side cursor (yield_per) and written out batch by batch, so memory
+# stays flat whatever the table size. The CSV and JSONL layouts are the ones
+# `flask import-data` reads.
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def genre_names(genre_table, owner_key, owner_id):
+  """
+  Returns the ;-separated genre names of a venue or artist
+  """
+  if db.engine.dialect.name == 'postgresql':
+    names = func.string_agg(Genre.name, ';')
+  else:
+    names = func.group_concat(Genre.name, ';')
+  return db.session.query(names).join(genre_table, genre_table.c.genre_id == Genre.id
+    ).filter(genre_table.c[owner_key] == owner_id).as_scalar()
+
+
+def venues_export():
+  return db.session.query(
+    Venue.id, Venue.name, Venue.address, City.name.label('city'), State.name.label('state'),
+    Venue.phone, Venue.image_link, Venue.facebook_link, Venue.website,
+    Venue.seeking_talent, Venue.seeking_description,
+    genre_names(genres_venues, 'venue_id', Venue.id).label('genres'),
+    Venue.past_shows_count, Venue.upcoming_shows_count,
+  ).join(City, Venue.city_id == City.id).join(State, City.state_id == State.id).order_by(Venue.id)
+
+
+def artists_export():
+  return db.session.query(
+    Artist.id, Artist.name, City.name.label('city'), State.name.label('state'),
+    Artist.phone, Artist.image_link, Artist.facebook_link, Artist.website,
+    Artist.seeking_venue, Artist.seeking_description,
+    genre_names(genres_artists, 'artist_id', Artist.id).label('genres'),
+    Artist.past_shows_count, Artist.upcoming_shows_count,
+  ).join(City, Artist.city_id == City.id).join(State, City.state_id == State.id).order_by(Artist.id)
+
+
+def shows_export():
+  return db.session.query(
+    Show.id, Show.start_time,
+    Show.venue_id, Venue.name.label('venue_name'),
+    Show.artist_id, Artist.name.label('artist_name'),
+    City.name.label('city'), State.name.label('state'),
+  ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id
+  ).join(City, Venue.city_id == City.id).join(State, City.state_id == State.id).order_by(Show.id)
+
+
+EXPORTS = {
+  'venues': venues_export,
+  'artists': artists_export,
+  'shows': shows_export,
+}
+
+
+def export_batches(query, batch_size=EXPORT_BATCH_SIZE):
+  """
+  Yields the rows of a query in lists of batch_size, read through a
+  server-side cursor
+  """
+  rows = iter(query.yield_per(batch_size))
+  while True:
+    batch = list(islice(rows, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+def split_genres(record):
+  if 'genres' in record:
+    record['genres'] = record['genres'].split(';') if record['genres'] else []
+  return record
+
+
+def csv_chunks(columns, batches):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(columns)
+  for batch in batches:
+    writer.writerows(batch)
+    yield buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def jsonl_chunks(columns, batches):
+  for batch in batches:
+    yield b''.join(dumps(split_genres(dict(zip(columns, row)))) + b'\n' for row in batch)
+
+
+class ChunkSink(io.RawIOBase):
+  """
+  Write-only file collecting what Parquet writes, drained after each batch
+  """
+
+  def __init__(self):
+    self.chunks = []
+    self.position = 0
+
+  def writable(self):
+    return True
+
+  def write(self, data):
+    self.chunks.append(bytes(data))
+    self.position += len(data)
+    return len(data)
+
+  def tell(self):
+    return self.position
+
+  def drain(self):
+    data = b''.join(self.chunks)
+    self.chunks = []
+    return data
+
+
+def parquet_schema(query):
+  """
+  Returns the Arrow schema of an export query, from its column types
+  """
+  fields = []
+  for column in query.column_descriptions:
+    column_type = column['type']
+    if column['name'] == 'genres':
+      arrow_type = pyarrow.list_(pyarrow.string())
+    elif isinstance(column_type, Integer):
+      arrow_type = pyarrow.int64()
+    elif isinstance(column_type, Boolean):
+      arrow_type = pyarrow.bool_()
+    elif isinstance(column_type, DateTime):
+      arrow_type = pyarrow.timestamp('us')
+    else:
+      arrow_type = pyarrow.string()
+    fields.append(pyarrow.field(column['name'], arrow_type))
+  return pyarrow.schema(fields)
+
+
+def parquet_chunks(columns, batches, schema):
+  """
+  Writes one Parquet row group per batch; the footer comes last
+  """
+  sink = ChunkSink()
+  writer = pyarrow.parquet.ParquetWriter(sink, schema)
+  for batch in batches:
+    records = [split_genres(dict(zip(columns, row))) for row in batch]
+    writer.write_table(pyarrow.Table.from_pylist(records, schema=schema))
+    yield sink.drain()
+  writer.close()
+  yield sink.drain()
+
+
+EXPORT_FORMATS = {
+  'csv': 'text/csv',
+  'jsonl': 'application/x-ndjson',
+  'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_chunks(resource, export_format, batch_size=EXPORT_BATCH_SIZE):
+  """
+  Yields the export of a resource as byte chunks, one per batch of rows
+  """
+  if export_format == 'parquet' and pyarrow is None:
+    raise RuntimeError('Parquet exports need the pyarrow package installed.')
+  query = EXPORTS[resource]()
+  columns = [column['name'] for column in query.column_descriptions]
+  batches = export_batches(query, batch_size)
+  if export_format == 'csv':
+    return csv_chunks(columns, batches)
+  if export_format == 'jsonl':
+    return jsonl_chunks(columns, batches)
+  return parquet_chunks(columns, batches, parquet_schema(query))
+
+
+@app.route('/api/v1/export/<resource>')
+def api_export(resource):
+  if resource not in EXPORTS:
+    raise APIError(f'Unknown export {resource}', 404)
+  export_format = request.args.get('format', 'csv')
+  if export_format not in EXPORT_FORMATS:
+    raise APIError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+  try:
+    chunks = export_chunks(resource, export_format)
+  except RuntimeError as error:
+    raise APIError(str(error), 501)
+  return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format], headers={
+    'Content-Disposition': f'attachment; filename={resource}.{export_format}',
+  })
+
+
+@app.cli.command('export-data')
+@click.argument('resource', type=click.Choice(list(EXPORTS)))
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Defaults to stdout.')
+@click.option('--batch-size', type=int, default=EXPORT_BATCH_SIZE, show_default=True)
+def export_data_command(resource, export_format, output, batch_size):
+  """
+  Writes every venue, artist or show as CSV, JSONL or Parquet.
+  """
+  try:
+    chunks = export_chunks(resource, export_format, batch_size)
+  except RuntimeError as error:
+    raise click.ClickException(str(error))
+  for chunk in chunks:
+    output.write(chunk)
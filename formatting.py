@@ -0,0 +1,62 @@
+from datetime import datetime
+from functools import lru_cache
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+
+#----------------------------------------------------------------------------#
+# Date formatting.
+#----------------------------------------------------------------------------#
+# The `datetime` template filter formats every show time on a page. It takes
+# datetime objects as the queries return them, parses each format's Babel
+# pattern and locale once, and remembers the text of recent values, since
+# the same shows are rendered over and over. Output is the same as calling
+# babel.dates.format_datetime directly.
+
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+# formats Babel names itself rather than taking as patterns
+BABEL_NAMED_FORMATS = ('long', 'short')
+
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  """
+  Returns the parsed Babel pattern and Locale of a format name or pattern
+  """
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), Locale.parse(locale)
+
+
+@lru_cache(maxsize=4096)
+def format_datetime_value(value, format, locale):
+  if format in BABEL_NAMED_FORMATS:
+    return babel.dates.format_datetime(value, format, locale=locale)
+  pattern, parsed_locale = datetime_pattern(format, locale)
+  if value.tzinfo is None:
+    # Babel reads naive times as UTC
+    value = value.replace(tzinfo=babel.dates.UTC)
+  return pattern.apply(value, parsed_locale)
+
+
+def parse_datetime(value):
+  """
+  Returns a datetime for a string such as str(datetime) gives
+  """
+  try:
+    return datetime.fromisoformat(value)
+  except ValueError:
+    return dateutil.parser.parse(value)
+
+
+def format_datetime(value, format='medium', locale=None):
+  """
+  Returns a datetime (or a date and time string) formatted with one of
+  DATETIME_FORMATS, a Babel format name, or a Babel pattern
+  """
+  if isinstance(value, str):
+    value = parse_datetime(value)
+  return format_datetime_value(value, format, locale or babel.dates.LC_TIME)
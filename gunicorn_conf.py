@@ -0,0 +1,72 @@
+import multiprocessing
+import os
+
+#----------------------------------------------------------------------------#
+# Gunicorn.
+#----------------------------------------------------------------------------#
+# Production entry point: `gunicorn -c gunicorn_conf.py app:app`.
+# The app is imported once in the master and the workers are forked from
+# it, so they share its code and SECRET_KEY. Database connections must not
+# cross the fork: every worker disposes the pools it inherited.
+
+os.environ.setdefault('FLASK_ENV', 'production')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or ('gthread' if threads > 1 else 'sync')
+preload_app = True
+
+if worker_class == 'gevent':
+  # GUNICORN_WORKER_CLASS=gevent serves each request in a greenlet, and
+  # psycopg2 yields while PostgreSQL works, so a worker overlaps up to
+  # worker_connections requests and their queries. The process is patched
+  # here, before the app is preloaded, so its locks and sockets cooperate.
+  # The thumbnail pool's processes come from a forkserver, which starts as
+  # a fresh interpreter and so resizes without gevent's patches.
+  from gevent import monkey
+  monkey.patch_all()
+  from db_pool import make_psycopg2_green
+  make_psycopg2_green()
+  worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+  os.environ.setdefault('DB_POOL_SIZE', '20')
+
+# each thread may hold a connection, so a worker's pool is sized to match
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+
+# seconds an idle client connection is kept open; keep it above the idle
+# timeout of a load balancer in front, below it when clients connect directly
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = 30
+graceful_timeout = 30
+
+# recycle workers now and then so slow leaks never build up, jittered so
+# they do not all restart at once
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+  # runs in the master once the app is preloaded, before any worker forks
+  from template_cache import warm_up
+  try:
+    warm_up()
+  except Exception as error:
+    server.log.warning(f'Warm-up failed: {error}')
+
+
+def post_fork(server, worker):
+  from app_config import app, db
+  from autocomplete import suggestions
+  from reference import REFERENCE_CACHES
+  with app.app_context():
+    for bind_key in [None] + list(app.config['SQLALCHEMY_BINDS'] or {}):
+      db.get_engine(app, bind=bind_key).dispose()
+  # the master filled these while warming up, possibly long before this
+  # worker forked (e.g. on kill -HUP), so each worker reloads its own
+  suggestions.invalidate()
+  for cache in REFERENCE_CACHES.values():
+    cache.invalidate()
@@ -0,0 +1,181 @@
+import multiprocessing
+import random
+import signal
+from datetime import datetime, timedelta
+import click
+from app_config import app, db
+from models import Venue, Artist, Show, Job
+from counters import refresh_show_counters
+from conditional import touch
+
+
+#----------------------------------------------------------------------------#
+# Job queue.
+#----------------------------------------------------------------------------#
+# Write handlers enqueue slow follow-up work as rows of the Job table, in
+# the same transaction as the write, so a job exists exactly when its write
+# committed. `flask work-jobs` claims due jobs with SELECT ... FOR UPDATE
+# SKIP LOCKED, so any number of worker processes share the queue without
+# a broker. A failed job is retried with exponential backoff up to
+# JOB_MAX_ATTEMPTS times, then left as 'failed' with its last error.
+
+JOB_HANDLERS = {}
+
+
+def job(kind):
+  """
+  Registers a function as the handler of a job kind. It is called with the
+  payload given to enqueue() as keyword arguments.
+  """
+  def decorator(handler):
+    JOB_HANDLERS[kind] = handler
+    return handler
+  return decorator
+
+
+def enqueue(kind, delay=0, **payload):
+  """
+  Adds a job to the current transaction; it runs once that commits
+  """
+  if kind not in JOB_HANDLERS:
+    raise LookupError(f'No handler for job kind {kind}')
+  db.session.add(Job(kind=kind, payload=payload, run_at=datetime.now() + timedelta(seconds=delay)))
+
+
+def retry_delay(attempts):
+  """
+  Returns the seconds to wait before another attempt: exponential, capped
+  and jittered so failed jobs do not retry in lockstep
+  """
+  delay = min(app.config['JOB_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1), app.config['JOB_RETRY_MAX_SECONDS'])
+  return delay * random.uniform(0.9, 1.1)
+
+
+def claim_jobs(limit):
+  """
+  Marks up to limit due jobs as running and returns their (id, kind,
+  payload). Jobs left running past JOB_LOCK_TIMEOUT by a worker that died
+  are queued again first.
+  """
+  now = datetime.now()
+  Job.query.filter(
+    Job.status == 'running',
+    Job.locked_at < now - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT'])
+  ).update({Job.status: 'queued'}, synchronize_session=False)
+  jobs = Job.query.filter(Job.status == 'queued', Job.run_at <= now
+    ).order_by(Job.run_at, Job.id).limit(limit).with_for_update(skip_locked=True).all()
+  claimed = []
+  for queued in jobs:
+    queued.status = 'running'
+    queued.attempts += 1
+    queued.locked_at = now
+    claimed.append((queued.id, queued.kind, queued.payload))
+  db.session.commit()
+  return claimed
+
+
+def run_job(job_id, kind, payload):
+  """
+  Runs a claimed job, deleting it when done and scheduling a retry, or
+  marking it failed, when its handler raises
+  """
+  try:
+    if kind not in JOB_HANDLERS:
+      raise LookupError(f'No handler for job kind {kind}')
+    JOB_HANDLERS[kind](**payload)
+    Job.query.filter_by(id=job_id).delete(synchronize_session=False)
+    db.session.commit()
+    return True
+  except Exception as error:
+    db.session.rollback()
+    failed = Job.query.get(job_id)
+    failed.last_error = f'{type(error).__name__}: {error}'[:2000]
+    if failed.attempts >= app.config['JOB_MAX_ATTEMPTS']:
+      failed.status = 'failed'
+      app.logger.error(f'Job {job_id} ({kind}) failed for good: {failed.last_error}')
+    else:
+      failed.status = 'queued'
+      failed.run_at = datetime.now() + timedelta(seconds=retry_delay(failed.attempts))
+    db.session.commit()
+    return False
+
+
+def work(stop, batch_size, poll_interval, once=False):
+  """
+  Claims and runs jobs until stop is set, or the queue is empty with once
+  """
+  while not stop.is_set():
+    claimed = claim_jobs(batch_size)
+    for job_id, kind, payload in claimed:
+      run_job(job_id, kind, payload)
+    if not claimed:
+      if once:
+        return
+      stop.wait(poll_interval)
+
+
+def worker_process(stop, batch_size, poll_interval, once):
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+  with app.app_context():
+    # connections inherited from the parent must not be shared
+    db.engine.dispose()
+    work(stop, batch_size, poll_interval, once)
+
+
+@app.cli.command('work-jobs')
+@click.option('--processes', type=int, default=2, show_default=True)
+@click.option('--batch-size', type=int, default=10, show_default=True, help='Jobs claimed at a time.')
+@click.option('--poll', 'poll_interval', type=float, default=1.0, show_default=True,
+  help='Seconds to wait when the queue is empty.')
+@click.option('--once', is_flag=True, help='Exit once no job is due.')
+def work_jobs_command(processes, batch_size, poll_interval, once):
+  """
+  Runs queued jobs in a pool of worker processes until interrupted.
+  """
+  context = multiprocessing.get_context('fork')
+  stop = context.Event()
+  workers = [
+    context.Process(target=worker_process, args=(stop, batch_size, poll_interval, once))
+    for _ in range(processes)
+  ]
+  db.engine.dispose()
+  for worker in workers:
+    worker.start()
+  signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+  try:
+    for worker in workers:
+      worker.join()
+  except KeyboardInterrupt:
+    stop.set()
+    for worker in workers:
+      worker.join()
+
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+@job('touch_venue_artists')
+def touch_venue_artists(venue_id):
+  """
+  Bumps the artists playing at a venue, whose pages show its name
+  """
+  touch(Artist, db.session.query(Show.artist_id).filter_by(venue_id=venue_id))
+
+
+@job('touch_artist_venues')
+def touch_artist_venues(artist_id):
+  """
+  Bumps the venues hosting an artist, whose pages show its name
+  """
+  touch(Venue, db.session.query(Show.venue_id).filter_by(artist_id=artist_id))
+
+
+@job('refresh_artists')
+def refresh_artists(artist_ids):
+  """
+  Recounts and bumps artists whose shows changed, e.g. after a venue was deleted
+  """
+  refresh_show_counters(Artist, artist_ids)
+  touch(Artist, artist_ids)
@@ -0,0 +1,33 @@
+#!/usr/bin/env bash
+# Load test of the production server: for each worker count given (default
+# 1 2 4 8), start gunicorn with gunicorn_conf.py, drive the benchmark route
+# mix at it with 8 client threads per worker, and print requests per second.
+# Run it against a seeded database (flask seed-data), on an otherwise idle
+# machine; throughput should grow with workers until the cores run out.
+#
+#   ./loadtest.sh 1 2 4 8
+#   DURATION=60 ./loadtest.sh 4
+set -euo pipefail
+
+export FLASK_APP=app.py
+PORT=${PORT:-8000}
+DURATION=${DURATION:-30}
+mkdir -p benchmarks
+
+for workers in "${@:-1 2 4 8}"; do
+  for count in $workers; do
+    WEB_CONCURRENCY=$count PORT=$PORT gunicorn -c gunicorn_conf.py app:app \
+      --access-logfile /dev/null --pid benchmarks/gunicorn.pid &
+    until curl -sf "http://127.0.0.1:$PORT/" > /dev/null; do sleep 0.5; done
+
+    output=benchmarks/loadtest-$count-workers.json
+    flask benchmark --url "http://127.0.0.1:$PORT" --duration "$DURATION" \
+      --concurrency $((count * 8)) --output "$output" > /dev/null
+    kill "$(cat benchmarks/gunicorn.pid)"
+    wait
+
+    python -c "import json, sys; total = json.load(open(sys.argv[1]))['total']; \
+print(f\"{sys.argv[2]:>3} workers: {total['throughput_rps']:8.1f} req/s  \
+p95 {total['p95_ms']:.1f} ms  p99 {total['p99_ms']:.1f} ms\")" "$output" "$count"
+  done
+done
@@ -0,0 +1,48 @@
+"""empty message
+
+Revision ID: 9d2e7a41c6f0
+Revises: 3f9a1c2d7b54
+Create Date: 2026-10-18 10:03:27.551902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e7a41c6f0'
+down_revision = '3f9a1c2d7b54'
+branch_labels = None
+depends_on = None
+
+# Trigram indexes serve the ILIKE '%term%' and similarity() lookups in
+# search.py, the tsvector indexes serve its full-text match. They are
+# PostgreSQL specific, so they are not declared on the models.
+TRGM_INDEXES = [
+    ('ix_venue_name_trgm', 'Venue', 'name'),
+    ('ix_venue_address_trgm', 'Venue', 'address'),
+    ('ix_artist_name_trgm', 'Artist', 'name'),
+    ('ix_city_name_trgm', 'City', 'name'),
+    ('ix_genre_name_trgm', 'Genre', 'name'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRGM_INDEXES:
+        op.create_index(name, table, [column], unique=False,
+                        postgresql_using='gin',
+                        postgresql_ops={column: 'gin_trgm_ops'})
+    op.create_index('ix_venue_search_document', 'Venue', [sa.text(
+        "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(address, ''))"
+    )], unique=False, postgresql_using='gin')
+    op.create_index('ix_artist_search_document', 'Artist', [sa.text(
+        "to_tsvector('simple', coalesce(name, ''))"
+    )], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_artist_search_document', table_name='Artist')
+    op.drop_index('ix_venue_search_document', table_name='Venue')
+    for name, table, column in reversed(TRGM_INDEXES):
+        op.drop_index(name, table_name=table)
@@ -8,20 +8,23 @@ from datetime import datetime
 genres_venues = db.Table(
   'genres_venues',
   db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True),
-  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True)
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+  db.Index('ix_genres_venues_genre_id', 'genre_id')
 )
 
 
 genres_artists = db.Table(
   'genres_artists',
   db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True),
-  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True)
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+  db.Index('ix_genres_artists_genre_id', 'genre_id')
 )
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
     __table_args__ = (
       db.UniqueConstraint('name', 'address', 'city_id', name='unique_venue'),
+      db.Index('ix_venue_city_id', 'city_id'),
     ) # a venue is unique basing on its name and address
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -32,69 +35,54 @@ class Venue(db.Model):
     website = db.Column(db.String(250), nullable=True)
     seeking_talent = db.Column(db.Boolean(), default=False, nullable=True)
     seeking_description =  db.Column(db.String(500), nullable=True)
+    updated_at = db.Column(
+      db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+      server_default=db.func.now())
     shows = db.relationship('Show', backref='venue', lazy=True, cascade="all, delete-orphan")
     city_id = db.Column(
       db.Integer, db.ForeignKey('City.id'), nullable=False)
     genres = db.relationship(
       'Genre', secondary=genres_venues, backref=db.backref('venues', lazy=True))
+    # maintained by counters.py, so listings never count shows
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
-    @property
-    def upcoming_shows(self):
+    def show_partition(self):
         """
-        Returns a list of upcoming shows
+        Returns past and upcoming shows with their counts, split in one query
         """
-        current_time = datetime.now()
-        shows_list = self.shows
-        upcoming_shows = [show for show in shows_list if show.start_time >= current_time]
-        upcoming_shows_list = []
-        for show in upcoming_shows:
-          show_dict = {
-            'artist_id': show.artist_id,
-            'artist_name': show.artist.name,
-            'artist_image_link': show.artist.image_link,
-            'start_time': str(show.start_time),
-            }
-          upcoming_shows_list.append(show_dict)
-        return upcoming_shows_list
+        return show_partition(Show.venue_id, self.id, Artist, 'artist')
 
     @property
-    def num_upcoming_shows(self):
+    def upcoming_shows(self):
         """
-        Returns the number of upcoming shows
+        Returns a list of upcoming shows
         """
-        upcoming_shows = self.upcoming_shows
-        return len(upcoming_shows)
-  
+        return self.show_partition()['upcoming_shows']
+
     @property
     def past_shows(self):
         """
         Returns a list of past shows
         """
-        current_time = datetime.now()
-        past_shows = [show for show in self.shows if show.start_time < current_time]
-        past_shows_list = []
-        for show in past_shows:
-          show_dict = {
-            'artist_id': show.artist_id,
-            'artist_name': show.artist.name,
-            'artist_image_link': show.artist.image_link,
-            'start_time': str(show.start_time),
-            }
-          past_shows_list.append(show_dict)
-        return past_shows_list
+        return self.show_partition()['past_shows']
 
     @property
-    def past_shows_count(self):
+    def num_upcoming_shows(self):
         """
-        Returns number of past shows
+        Returns the number of upcoming shows
         """
-        return len(self.past_shows)
+        return self.upcoming_shows_count
+
     def __repr__(self):
         return f'<Venue: id: {self.id} name: {self.name}>'
 
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+      db.Index('ix_artist_city_id', 'city_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True)
@@ -104,61 +92,37 @@ class Artist(db.Model):
     website = db.Column(db.String(250), nullable=True)
     seeking_venue = db.Column(db.Boolean(), default=False, nullable=True)
     seeking_description =  db.Column(db.String(500), nullable=True)
+    updated_at = db.Column(
+      db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+      server_default=db.func.now())
     shows = db.relationship('Show', backref='artist', lazy=True)
     city_id = db.Column(
       db.Integer, db.ForeignKey('City.id'), nullable=False)
     genres = db.relationship(
       'Genre', secondary=genres_artists, backref=db.backref('artists', lazy=True))
+    # maintained by counters.py, so listings never count shows
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def show_partition(self):
+        """
+        Returns past and upcoming shows with their counts, split in one query
+        """
+        return show_partition(Show.artist_id, self.id, Venue, 'venue')
 
     @property
     def upcoming_shows(self):
         """
         Returns a list of upcoming shows
         """
-        current_time = datetime.now()
-        upcoming_shows = [show for show in self.shows if show.start_time > current_time]
-        upcoming_show_list = []
-        for show in upcoming_shows:
-          show_dict = {
-            'venue_id':show.venue_id,
-            'venue_name':show.venue.name,
-            'venue_image_link': show.venue.image_link,
-            'start_time': str(show.start_time),
-          }
-          upcoming_show_list.append(show_dict)
-        return upcoming_show_list
+        return self.show_partition()['upcoming_shows']
 
     @property
     def past_shows(self):
         """
         Returns a list of past shows
         """
-        current_time = datetime.now()
-        past_shows = [show for show in self.shows if show.start_time < current_time]
-        past_shows_list = []
-        for show in past_shows:
-            show_dict = {
-            'venue_id':show.venue_id,
-            'venue_name':show.venue.name,
-            'venue_image_link': show.venue.image_link,
-            'start_time': str(show.start_time),
-            }
-            past_shows_list.append(show_dict)
-        return past_shows_list
-
-    @property
-    def past_shows_count(self):
-        """
-        Returns number of past shows
-        """
-        return len(self.past_shows)
-
-    @property
-    def upcoming_shows_count(self):
-        """
-        Returns number of upcoming shows
-        """
-        return len(self.upcoming_shows)
+        return self.show_partition()['past_shows']
 
     def __repr__(self):
         return f'<Artist: id: {self.id} name: {self.name}>'
@@ -167,6 +131,9 @@ class Show(db.Model):
   __tablename__ = 'Show'
   __table_args__ = (
     db.UniqueConstraint('artist_id', 'venue_id', 'start_time', name='unique_show'),
+    db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
   )
   id = db.Column(db.Integer, primary_key=True)
   artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'),
@@ -174,6 +141,36 @@ class Show(db.Model):
   venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'),
         nullable=False)
   start_time = db.Column(db.DateTime, nullable=False)
+  updated_at = db.Column(
+    db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now,
+    server_default=db.func.now())
+
+
+def show_partition(owner_column, owner_id, other, prefix):
+  """
+  Returns past and upcoming shows of one venue or artist.
+  The other side of the show is joined in and the past/upcoming split
+  is computed by the database, so a single statement covers both lists
+  and their counts.
+  """
+  is_past = (Show.start_time < datetime.now()).label('is_past')
+  rows = db.session.query(
+      Show.start_time, other.id, other.name, other.image_link, is_past
+    ).join(other, other.id == getattr(Show, f'{prefix}_id')
+    ).filter(owner_column == owner_id
+    ).order_by(Show.start_time).all()
+  partition = {'past_shows': [], 'upcoming_shows': []}
+  for start_time, other_id, name, image_link, past in rows:
+    key = 'past_shows' if past else 'upcoming_shows'
+    partition[key].append({
+      f'{prefix}_id': other_id,
+      f'{prefix}_name': name,
+      f'{prefix}_image_link': image_link,
+      'start_time': start_time,
+    })
+  partition['past_shows_count'] = len(partition['past_shows'])
+  partition['upcoming_shows_count'] = len(partition['upcoming_shows'])
+  return partition
 
 
 class State(db.Model):
@@ -188,6 +185,9 @@ class State(db.Model):
 
 class City(db.Model):
   __tablename__ = 'City'
+  __table_args__ = (
+    db.Index('ix_city_state_id', 'state_id'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(100), nullable=False, unique=True)
@@ -207,4 +207,27 @@ class Genre(db.Model):
   name = db.Column(db.String(100), nullable=False, unique=True)
 
   def __repr__(self):
-    return self.name
\ No newline at end of file
+    return self.name
+
+class Job(db.Model):
+  """
+  Background work queued by the write handlers, run by `flask work-jobs`
+  """
+  __tablename__ = 'Job'
+  __table_args__ = (
+    db.Index('ix_job_status_run_at', 'status', 'run_at'),
+  )
+
+  id = db.Column(db.Integer, primary_key=True)
+  kind = db.Column(db.String(50), nullable=False)
+  payload = db.Column(db.JSON, nullable=False, default=dict)
+  # queued, running or failed; finished jobs are deleted
+  status = db.Column(db.String(10), nullable=False, default='queued', server_default='queued')
+  attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  run_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+  locked_at = db.Column(db.DateTime, nullable=True)
+  last_error = db.Column(db.Text, nullable=True)
+  created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+
+  def __repr__(self):
+    return f'<Job: id: {self.id} kind: {self.kind} status: {self.status}>'
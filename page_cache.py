@@ -0,0 +1,310 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from flask import request, session
+from app_config import app, db
+from models import Show
+from replicas import REPLICA_INFO_KEY
+
+try:
+  import redis
+except ImportError:
+  redis = None
+
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+# Rendered read-only pages are cached by path and query string. Every entry
+# carries tags naming what it shows ('venues', 'venue:3', ...) and the write
+# handlers evict by tag right after they commit. PAGE_CACHE_TTL bounds how
+# long a page lives, which also covers shows moving from upcoming to past.
+#
+# An eviction also stamps its tags with the time, and a page whose tags
+# were stamped after it started rendering is dropped, since it may have
+# read the data from before the write. The 'lru' backend lives in each
+# worker and keeps the stamps in PAGE_CACHE_EVICTION_DIR, shared by the
+# workers on a host; the 'redis' backend, the default with REDIS_URL set,
+# keeps them in Redis. Pages rendered from a replica count as started
+# READ_YOUR_WRITES_SECONDS earlier, the replica lag the app allows for, so
+# a lagging replica cannot put a page older than the last write back into
+# the cache.
+
+class EvictionStamps:
+  """
+  One file per evicted tag whose mtime is the time of its last eviction,
+  shared by every process using the same directory
+  """
+
+  def __init__(self, directory, ttl):
+    # ttl: seconds a stamp may still matter to a cached page
+    self.directory = directory
+    self.ttl = ttl
+    self.pruned_at = time.time()
+    os.makedirs(directory, exist_ok=True)
+
+  def path(self, tag):
+    return os.path.join(self.directory, tag.replace('/', '_').replace(':', '-'))
+
+  def stamp(self, tags):
+    # the time is set explicitly: filesystems stamp files from a coarse clock
+    now = time.time()
+    for tag in tags:
+      path = self.path(tag)
+      with open(path, 'a'):
+        pass
+      os.utime(path, (now, now))
+    if now - self.pruned_at > self.ttl:
+      self.prune(now)
+
+  def evicted_since(self, tags, since):
+    """
+    Returns whether any of the tags was evicted at or after since
+    """
+    for tag in tags:
+      try:
+        if os.stat(self.path(tag)).st_mtime >= since:
+          return True
+      except FileNotFoundError:
+        pass
+    return False
+
+  def prune(self, now):
+    """
+    Removes stamps older than any cached page
+    """
+    self.pruned_at = now
+    for entry in os.scandir(self.directory):
+      try:
+        if entry.stat().st_mtime < now - self.ttl:
+          os.remove(entry.path)
+      except FileNotFoundError:
+        pass
+
+
+class LRUBackend:
+  """
+  In-process cache holding up to max_entries pages, least recently used
+  evicted first. Each worker process has its own copy; evictions reach the
+  other processes through the stamps in eviction_dir, if given, kept for
+  stamp_ttl seconds.
+  """
+
+  def __init__(self, max_entries, ttl, eviction_dir=None, stamp_ttl=None):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.tags = defaultdict(set)
+    self.lock = threading.Lock()
+    self.stamps = EvictionStamps(eviction_dir, stamp_ttl or ttl) if eviction_dir else None
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      expires_at, rendered_at, value, tags = entry
+      if expires_at < time.monotonic() or (
+          self.stamps is not None and self.stamps.evicted_since(tags, rendered_at)):
+        self._remove(key)
+        return None
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, tags, rendered_at=None):
+    """
+    Stores a page whose rendering started at rendered_at (time.time()),
+    unless one of its tags was evicted since
+    """
+    rendered_at = rendered_at or time.time()
+    if self.stamps is not None and self.stamps.evicted_since(tags, rendered_at):
+      return
+    with self.lock:
+      if key in self.entries:
+        self._remove(key)
+      self.entries[key] = (time.monotonic() + self.ttl, rendered_at, value, tags)
+      for tag in tags:
+        self.tags[tag].add(key)
+      while len(self.entries) > self.max_entries:
+        self._remove(next(iter(self.entries)))
+
+  def evict(self, tags):
+    with self.lock:
+      for tag in tags:
+        for key in list(self.tags.pop(tag, ())):
+          self._remove(key)
+    if self.stamps is not None:
+      self.stamps.stamp(tags)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.tags.clear()
+
+  def _remove(self, key):
+    expires_at, rendered_at, value, tags = self.entries.pop(key)
+    for tag in tags:
+      keys = self.tags.get(tag)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self.tags[tag]
+
+
+class RedisBackend:
+  """
+  Cache shared by every worker through a Redis server, e.g. one started
+  locally with `redis-server`. Tags are Redis sets of the keys they cover,
+  eviction stamps are keys holding the time of the tag's last eviction, and
+  each page is stored after a header line with its render time and tags.
+  """
+
+  def __init__(self, url, ttl, prefix='fyyur:page:', stamp_ttl=None):
+    if redis is None:
+      raise RuntimeError('PAGE_CACHE_BACKEND = "redis" needs the redis package installed.')
+    self.client = redis.Redis.from_url(url)
+    self.ttl = ttl
+    self.stamp_ttl = stamp_ttl or ttl
+    self.prefix = prefix
+
+  def stamp_key(self, tag):
+    return f'{self.prefix}evicted:{tag}'
+
+  def evicted_since(self, tags, since):
+    """
+    Returns whether any of the tags was evicted at or after since
+    """
+    if not tags:
+      return False
+    stamps = self.client.mget([self.stamp_key(tag) for tag in tags])
+    return any(stamp is not None and float(stamp) >= since for stamp in stamps)
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    if value is None:
+      return None
+    header, body = value.decode('utf-8').split('\n', 1)
+    rendered_at, *tags = header.split()
+    if self.evicted_since(tags, float(rendered_at)):
+      return None
+    return body
+
+  def set(self, key, value, tags, rendered_at=None):
+    rendered_at = rendered_at or time.time()
+    if self.evicted_since(tags, rendered_at):
+      return
+    header = ' '.join([repr(rendered_at)] + sorted(tags))
+    pipe = self.client.pipeline()
+    pipe.set(self.prefix + key, f'{header}\n{value}'.encode('utf-8'), ex=self.ttl)
+    for tag in tags:
+      tag_key = f'{self.prefix}tag:{tag}'
+      pipe.sadd(tag_key, key)
+      pipe.expire(tag_key, self.ttl)
+    pipe.execute()
+
+  def evict(self, tags):
+    now = repr(time.time())
+    for tag in tags:
+      tag_key = f'{self.prefix}tag:{tag}'
+      keys = self.client.smembers(tag_key)
+      pipe = self.client.pipeline()
+      pipe.set(self.stamp_key(tag), now, ex=self.stamp_ttl)
+      for key in keys:
+        pipe.delete(self.prefix + key.decode('utf-8'))
+      pipe.delete(tag_key)
+      pipe.execute()
+
+  def clear(self):
+    for key in self.client.scan_iter(self.prefix + '*'):
+      self.client.delete(key)
+
+
+def make_backend(config):
+  """
+  Returns the backend named by PAGE_CACHE_BACKEND, or None when disabled
+  """
+  backend = config.get('PAGE_CACHE_BACKEND')
+  ttl = config['PAGE_CACHE_TTL']
+  # a page read from a replica counts as rendered this much earlier
+  stamp_ttl = ttl + config['READ_YOUR_WRITES_SECONDS']
+  if backend == 'lru':
+    return LRUBackend(config['PAGE_CACHE_MAX_ENTRIES'], ttl, config['PAGE_CACHE_EVICTION_DIR'], stamp_ttl)
+  if backend == 'redis':
+    return RedisBackend(config['PAGE_CACHE_REDIS_URL'], ttl, stamp_ttl=stamp_ttl)
+  return None
+
+
+page_cache = make_backend(app.config)
+
+
+def cache_key():
+  """
+  Returns the cache key of the current request: its path and sorted arguments
+  """
+  args = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+  return f'{request.path}?{args}'
+
+
+def cached_page(*tags):
+  """
+  Caches the rendered page of a GET view under its path and arguments.
+  Tags may contain {placeholders} filled from the view arguments, e.g.
+  'venue:{venue_id}'. Pages with pending flash messages are never served
+  from or stored in the cache, since the message is part of the page.
+  """
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      if page_cache is None or session.get('_flashes'):
+        return view(*args, **kwargs)
+      key = cache_key()
+      body = page_cache.get(key)
+      if body is not None:
+        return body, 200, {'X-Cache': 'HIT'}
+      rendered_at = time.time()
+      if db.session.info.get(REPLICA_INFO_KEY) is not None:
+        # the replica may not have caught up with the latest evictions yet
+        rendered_at -= app.config['READ_YOUR_WRITES_SECONDS']
+      body = view(*args, **kwargs)
+      if not isinstance(body, str):
+        return body
+      page_cache.set(key, body, {tag.format(**kwargs) for tag in tags}, rendered_at)
+      return body, 200, {'X-Cache': 'MISS'}
+    return wrapper
+  return decorator
+
+
+def evict(*tags):
+  if page_cache is not None:
+    page_cache.evict(tags)
+
+
+def evict_venue(venue_id, artist_ids=None):
+  """
+  Evicts the pages showing a venue: the listings, the venue page, and the
+  pages of artists with shows there. Pass artist_ids when the shows are
+  already gone, e.g. after a delete.
+  """
+  if artist_ids is None:
+    artist_ids = [artist_id for artist_id, in
+      db.session.query(Show.artist_id).filter_by(venue_id=venue_id).distinct()]
+  evict('venues', 'shows', f'venue:{venue_id}', *[f'artist:{artist_id}' for artist_id in artist_ids])
+
+
+def evict_artist(artist_id):
+  """
+  Evicts the pages showing an artist: the listings, the artist page, and
+  the pages of venues hosting its shows
+  """
+  venue_ids = [venue_id for venue_id, in
+    db.session.query(Show.venue_id).filter_by(artist_id=artist_id).distinct()]
+  evict('artists', 'shows', f'artist:{artist_id}', *[f'venue:{venue_id}' for venue_id in venue_ids])
+
+
+def evict_show(venue_id, artist_id):
+  """
+  Evicts the pages listing a new show and the counts it changes
+  """
+  evict('venues', 'artists', 'shows', f'venue:{venue_id}', f'artist:{artist_id}')
@@ -0,0 +1,241 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+import click
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app_config import app, db
+from models import Venue, Artist
+import page_cache
+
+
+#----------------------------------------------------------------------------#
+# Query profiler.
+#----------------------------------------------------------------------------#
+# With QUERY_PROFILER on, every request records its statements, their time
+# and where they came from: the lazy relationship that loaded them, if any,
+# and the line of this app that triggered them. A statement shape repeated
+# N_PLUS_ONE_THRESHOLD times in one request is logged as an N+1 loop. The
+# totals go out in a Server-Timing header and the latest profiles are kept
+# for /api/metrics/queries, which shows statements and call sites and so is
+# only served while debugging or with QUERY_PROFILES_ENDPOINT on.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# bound parameters render as ? on sqlite and %(name)s on psycopg2
+PARAMETER = r'(?:\?|%\(\w+\)s)'
+IN_LIST = re.compile(rf'IN \({PARAMETER}(?:, {PARAMETER})*\)')
+recent_profiles = deque(maxlen=50)
+recent_lock = threading.Lock()
+
+
+def statement_shape(statement):
+  """
+  Returns a statement with its IN lists collapsed, so loops over different
+  ids share one shape
+  """
+  return IN_LIST.sub('IN (...)', ' '.join(statement.split()))
+
+
+def query_origin():
+  """
+  Returns (lazy relationship, app call site) of the statement being run
+  """
+  relationship = call_site = None
+  frame = sys._getframe(2)
+  while frame is not None and call_site is None:
+    code = frame.f_code
+    if relationship is None and code.co_name == '_load_for_state':
+      loader = frame.f_locals.get('self')
+      relationship = str(getattr(loader, 'parent_property', '')) or None
+    elif (code.co_filename.startswith(APP_DIR) and code.co_filename != __file__
+        and 'site-packages' not in code.co_filename):
+      call_site = f'{os.path.basename(code.co_filename)}:{frame.f_lineno} in {code.co_name}'
+    frame = frame.f_back
+  return relationship, call_site
+
+
+class RequestProfile:
+  """
+  Statements run while serving one request
+  """
+
+  def __init__(self, method, path):
+    self.method = method
+    self.path = path
+    self.queries = []
+
+  def add(self, statement, duration, origin):
+    self.queries.append((statement_shape(statement), duration, origin))
+
+  @property
+  def count(self):
+    return len(self.queries)
+
+  @property
+  def total_ms(self):
+    return sum(duration for shape, duration, origin in self.queries) * 1000
+
+  def repeated(self, threshold):
+    """
+    Returns [(shape, times run, origins)] for shapes run at least threshold times
+    """
+    counts = Counter(shape for shape, duration, origin in self.queries)
+    return [
+      (shape, times, sorted({origin for other, duration, origin in self.queries if other == shape}, key=str))
+      for shape, times in counts.most_common() if times >= threshold
+    ]
+
+  def as_dict(self, threshold):
+    return {
+      'method': self.method,
+      'path': self.path,
+      'queries': self.count,
+      'db_ms': round(self.total_ms, 3),
+      'n_plus_one': [
+        {'statement': shape, 'times': times, 'origins': [
+          {'relationship': relationship, 'call_site': call_site} for relationship, call_site in origins
+        ]}
+        for shape, times, origins in self.repeated(threshold)
+      ],
+    }
+
+
+def current_profile():
+  if has_request_context():
+    return g.get('query_profile')
+  return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+  if current_profile() is not None:
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+  profile = current_profile()
+  started = conn.info.get('query_started')
+  if profile is not None and started:
+    profile.add(statement, time.perf_counter() - started.pop(), query_origin())
+
+
+@app.before_request
+def start_request_profile():
+  if app.config['QUERY_PROFILER']:
+    g.query_profile = RequestProfile(request.method, request.path)
+
+
+@app.after_request
+def finish_request_profile(response):
+  profile = g.get('query_profile')
+  if profile is None:
+    return response
+  threshold = app.config['N_PLUS_ONE_THRESHOLD']
+  for shape, times, origins in profile.repeated(threshold):
+    where = '; '.join(f'{relationship or "query"} from {call_site}' for relationship, call_site in origins)
+    app.logger.warning(f'N+1: {profile.method} {profile.path} ran {times}x [{where}]: {shape}')
+  response.headers.add('Server-Timing', f'db;dur={profile.total_ms:.1f};desc="{profile.count} queries"')
+  with recent_lock:
+    recent_profiles.append(profile.as_dict(threshold))
+  return response
+
+
+def query_profiles():
+  with recent_lock:
+    return jsonify(list(recent_profiles))
+
+
+if app.debug or app.config['QUERY_PROFILES_ENDPOINT']:
+  app.add_url_rule('/api/metrics/queries', view_func=query_profiles)
+
+
+#----------------------------------------------------------------------------#
+# Query budgets.
+#----------------------------------------------------------------------------#
+
+QUERY_BUDGETS = {
+  '/': 0,
+  '/venues': 1,
+  '/artists': 1,
+  '/shows': 1,
+  '/shows?upcoming=1': 1,
+  '/venues/{venue}': 4,
+  '/artists/{artist}': 4,
+  '/venues/{venue}/edit': 1,
+  '/artists/{artist}/edit': 1,
+  '/api/v1/venues': 1,
+  '/api/v1/venues/{venue}': 3,
+  '/api/v1/artists/{artist}': 3,
+}
+
+
+@contextmanager
+def query_budget(max_queries):
+  """
+  Fails when the requests made inside the block run more than max_queries
+  statements in total, e.g. around a test client call
+  """
+  statements = []
+
+  def count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  event.listen(Engine, 'before_cursor_execute', count)
+  try:
+    yield statements
+  finally:
+    event.remove(Engine, 'before_cursor_execute', count)
+  if len(statements) > max_queries:
+    raise AssertionError(f'{len(statements)} queries, budget {max_queries}:\n' + '\n'.join(statements))
+
+
+def check_query_budgets():
+  """
+  Returns {route: (url, queries, budget)} for every route over its query budget.
+  Pages are fetched twice and only the second, warm fetch counts, with the
+  page cache disabled.
+  """
+  ids = {
+    'venue': db.session.query(Venue.id).order_by(Venue.id).limit(1).scalar(),
+    'artist': db.session.query(Artist.id).order_by(Artist.id).limit(1).scalar(),
+  }
+  if None in ids.values():
+    raise click.ClickException('The database has no venues or artists to request.')
+  cache, page_cache.page_cache = page_cache.page_cache, None
+  client = app.test_client()
+  failures = {}
+  try:
+    for route, budget in QUERY_BUDGETS.items():
+      url = route.format(**ids)
+      client.get(url)
+      try:
+        with query_budget(budget) as statements:
+          response = client.get(url)
+      except AssertionError:
+        failures[route] = (url, len(statements), budget)
+        continue
+      if response.status_code != 200:
+        raise click.ClickException(f'{url} answered {response.status_code}.')
+  finally:
+    page_cache.page_cache = cache
+  return failures
+
+
+@app.cli.command('check-query-budgets')
+def check_query_budgets_command():
+  """
+  Fails when a page runs more queries than its budget in QUERY_BUDGETS.
+  """
+  failures = check_query_budgets()
+  for route in QUERY_BUDGETS:
+    click.echo(f"{'FAIL' if route in failures else 'ok':4} {route}")
+  for url, queries, budget in failures.values():
+    click.echo(f'     {url}: {queries} queries, budget {budget}')
+  if failures:
+    raise click.ClickException(f'{len(failures)} pages are over their query budget.')
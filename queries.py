@@ -0,0 +1,128 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+from app_config import db
+from models import Venue, City, State, Artist, Show
+
+
+#----------------------------------------------------------------------------#
+# Listing queries.
+#----------------------------------------------------------------------------#
+
+def parse_area_cursor(cursor):
+  """
+  Returns the (state, city, venue name, venue id) key encoded in an areas
+  cursor, or None
+  """
+  try:
+    state, city, name, venue_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return state, city, name, int(venue_id)
+  except (AttributeError, ValueError, TypeError, binascii.Error):
+    return None
+
+
+def area_cursor(state, city, name, venue_id):
+  return base64.urlsafe_b64encode(json.dumps([state, city, name, venue_id]).encode('utf-8')).decode('ascii')
+
+
+def venue_areas(cursor=None, per_page=50):
+  """
+  Returns one page of venues grouped by city/state, and the cursor of the
+  next page. Venues are ordered by (state, city, venue name, id) and paged
+  by keyset on that key, so every page holds per_page venues however big
+  a city is, and deep pages cost the same as the first; a city spanning
+  pages is continued on the next one. A single statement selects the
+  per_page cities the page can reach and joins their venues.
+  """
+  cities = db.session.query(
+      City.id.label('city_id'),
+      City.name.label('city'),
+      State.name.label('state')
+    ).join(State, State.id == City.state_id
+    ).filter(City.venues.any())
+  after = parse_area_cursor(cursor)
+  if after is not None:
+    cities = cities.filter(tuple_(State.name, City.name) >= after[:2])
+  # every city has a venue, so per_page cities hold the whole page
+  page = cities.order_by(State.name, City.name).limit(per_page).subquery()
+
+  venues = db.session.query(
+      page.c.state, page.c.city, Venue.id, Venue.name, Venue.upcoming_shows_count
+    ).join(Venue, Venue.city_id == page.c.city_id)
+  if after is not None:
+    venues = venues.filter(tuple_(page.c.state, page.c.city, Venue.name, Venue.id) > after)
+  rows = venues.order_by(page.c.state, page.c.city, Venue.name, Venue.id).limit(per_page + 1).all()
+
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = area_cursor(*rows[-1][:2], rows[-1].name, rows[-1].id)
+
+  areas = []
+  for state, city, venue_id, venue_name, num_upcoming_shows in rows:
+    if not areas or (areas[-1]['state'], areas[-1]['city']) != (state, city):
+      areas.append({'city': city, 'state': state, 'venues': []})
+    areas[-1]['venues'].append({
+      'id': venue_id,
+      'name': venue_name,
+      'num_upcoming_shows': num_upcoming_shows,
+    })
+  return areas, next_cursor
+
+
+def parse_show_cursor(cursor):
+  """
+  Returns the (start_time, id) key encoded in a shows cursor, or None
+  """
+  if not cursor or '_' not in cursor:
+    return None
+  start_time, show_id = cursor.rsplit('_', 1)
+  try:
+    return datetime.fromisoformat(start_time), int(show_id)
+  except ValueError:
+    return None
+
+
+def show_feed(cursor=None, per_page=30, upcoming=False, start=None, end=None):
+  """
+  Returns one page of the shows feed and the cursor of the next page.
+  Only the columns a show tile needs are selected, through one join of
+  Show, Venue and Artist. Pages are keyed on (start_time, id), which the
+  ix_show_start_time_id index serves directly.
+  """
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+    ).join(Venue, Venue.id == Show.venue_id
+    ).join(Artist, Artist.id == Show.artist_id)
+  if upcoming:
+    query = query.filter(Show.start_time >= datetime.now())
+  if start is not None:
+    query = query.filter(Show.start_time >= start)
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+  after = parse_show_cursor(cursor)
+  if after is not None:
+    query = query.filter(tuple_(Show.start_time, Show.id) > after)
+  rows = query.order_by(Show.start_time, Show.id).limit(per_page + 1).all()
+
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = f'{rows[-1].start_time.isoformat()}_{rows[-1].id}'
+  shows = [{
+    'venue_id': row.venue_id,
+    'venue_name': row.venue_name,
+    'artist_id': row.artist_id,
+    'artist_name': row.artist_name,
+    'artist_image_link': row.artist_image_link,
+    'start_time': row.start_time,
+  } for row in rows]
+  return shows, next_cursor
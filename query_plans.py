@@ -0,0 +1,126 @@
+import re
+import click
+from sqlalchemy import event
+from app_config import app, db
+from models import Venue, Artist, Show, Genre, show_partition
+from queries import venue_areas, show_feed
+from counters import refresh_show_counters
+
+
+#----------------------------------------------------------------------------#
+# Query plan checks.
+#----------------------------------------------------------------------------#
+# The hot queries of the app must be served by indexes. check-query-plans
+# runs each of them against a seeded database, EXPLAINs every statement it
+# issued and fails when one of them scans a whole watched table.
+
+WATCHED_TABLES = {'Show', 'Venue', 'Artist', 'genres_venues', 'genres_artists'}
+
+HOT_QUERIES = {
+  'venue show partition':
+    lambda ids: show_partition(Show.venue_id, ids['venue'], Artist, 'artist'),
+  'artist show partition':
+    lambda ids: show_partition(Show.artist_id, ids['artist'], Venue, 'venue'),
+  'venue areas': lambda ids: venue_areas(),
+  'shows feed': lambda ids: show_feed(),
+  'upcoming shows feed': lambda ids: show_feed(upcoming=True),
+  'venue counters': lambda ids: refresh_show_counters(Venue, [ids['venue']]),
+  'artist counters': lambda ids: refresh_show_counters(Artist, [ids['artist']]),
+  'genre venues': lambda ids: Genre.query.get(ids['genre']).venues,
+  'genre artists': lambda ids: Genre.query.get(ids['genre']).artists,
+}
+
+POSTGRES_SEQ_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+# sqlite reports both table scans and full index walks as SCAN
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)\b')
+
+
+def record_statements(run):
+  """
+  Returns the (statement, parameters) pairs executed by run()
+  """
+  statements = []
+
+  def record(conn, cursor, statement, parameters, context, executemany):
+    statements.append((statement, parameters))
+
+  event.listen(db.engine, 'before_cursor_execute', record)
+  try:
+    run()
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', record)
+    db.session.rollback()
+  return statements
+
+
+def explain(statement, parameters):
+  """
+  Returns the plan lines of a statement
+  """
+  postgres = db.engine.dialect.name == 'postgresql'
+  prefix = 'EXPLAIN ' if postgres else 'EXPLAIN QUERY PLAN '
+  connection = db.engine.raw_connection()
+  try:
+    cursor = connection.cursor()
+    cursor.execute(prefix + statement, parameters)
+    rows = cursor.fetchall()
+  finally:
+    connection.close()
+  # PostgreSQL returns one text column, sqlite (id, parent, notused, detail)
+  return [row[0] if postgres else row[-1] for row in rows]
+
+
+def full_scans(statement, plan):
+  """
+  Returns the watched tables that a plan reads in full
+  """
+  if db.engine.dialect.name == 'postgresql':
+    pattern = POSTGRES_SEQ_SCAN
+  elif ' LIMIT ' in statement:
+    # an index walk in the ORDER BY of a LIMIT query stops early
+    pattern = re.compile(SQLITE_FULL_SCAN.pattern + r'$')
+  else:
+    pattern = SQLITE_FULL_SCAN
+  tables = set()
+  for line in plan:
+    match = pattern.search(line.strip())
+    if match and match.group(1) in WATCHED_TABLES:
+      tables.add(match.group(1))
+  return tables
+
+
+def check_query_plans():
+  """
+  Returns {query name: [(statement, scanned tables)]} for every hot query
+  that falls back to a full scan of a watched table
+  """
+  ids = {
+    'venue': db.session.query(Venue.id).order_by(Venue.id).limit(1).scalar(),
+    'artist': db.session.query(Artist.id).order_by(Artist.id).limit(1).scalar(),
+    'genre': db.session.query(Genre.id).order_by(Genre.id).limit(1).scalar(),
+  }
+  if None in ids.values():
+    raise click.ClickException('The database has no venues, artists or genres to plan against.')
+  failures = {}
+  for name, query in HOT_QUERIES.items():
+    for statement, parameters in record_statements(lambda: query(ids)):
+      tables = full_scans(statement, explain(statement, parameters))
+      if tables:
+        failures.setdefault(name, []).append((statement, tables))
+  return failures
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+  """
+  Fails when a hot query scans a whole Show, Venue, Artist or genre table.
+  Run it against a database seeded with realistic volumes; on a handful of
+  rows PostgreSQL rightly prefers sequential scans.
+  """
+  failures = check_query_plans()
+  for name in HOT_QUERIES:
+    click.echo(f"{'FAIL' if name in failures else 'ok':4} {name}")
+    for statement, tables in failures.get(name, []):
+      click.echo(f"     full scan of {', '.join(sorted(tables))} in: {' '.join(statement.split())}")
+  if failures:
+    raise click.ClickException(f'{len(failures)} hot queries fall back to full table scans.')
@@ -0,0 +1,273 @@
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from app_config import app, db
+from models import State, City, Genre
+
+
+#----------------------------------------------------------------------------#
+# Reference data.
+#----------------------------------------------------------------------------#
+
+# rows inserted by a session, added to their caches once it commits
+PENDING_ROWS_KEY = 'reference_rows'
+
+
+class ReferenceCache:
+  """
+  Process-level id <-> name maps of a small reference table.
+  The maps are loaded with one query and reused until they are stale. They
+  go stale when a row of the table is updated or deleted through the ORM
+  in this process, which bumps the version stamp, or when
+  REFERENCE_CACHE_TTL seconds have passed, which picks up writes made by
+  other processes. Rows inserted in this process are added once their
+  transaction commits, and an id missing from the maps loads just that row.
+  With case_insensitive, names are looked up stripped and lowercased.
+  """
+
+  def __init__(self, model, *columns, case_insensitive=False):
+    self.model = model
+    self.columns = ('id', 'name') + columns
+    self.row_type = namedtuple(f'{model.__name__}Row', self.columns)
+    self.case_insensitive = case_insensitive
+    self.version = 0
+    self.loaded_version = None
+    self.loaded_at = 0
+    self.rows = {}
+    self.ids = {}
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    event.listen(model, 'after_insert', self.inserted)
+    event.listen(model, 'after_update', self.invalidate_if_modified)
+    event.listen(model, 'after_delete', self.invalidate)
+
+  def invalidate(self, *args):
+    self.version += 1
+
+  def invalidate_if_modified(self, mapper, connection, target):
+    # rows are also flushed as updated when only a backref collection
+    # changed, e.g. Genre.venues when a venue is created
+    if object_session(target).is_modified(target, include_collections=False):
+      self.invalidate()
+
+  def inserted(self, mapper, connection, target):
+    self.add_on_commit(object_session(target), target)
+
+  def add_on_commit(self, session, row):
+    """
+    Adds a row to the maps once the session's transaction commits
+    """
+    row = self.row_type(*(getattr(row, column) for column in self.columns))
+    session.info.setdefault(PENDING_ROWS_KEY, []).append((self, row))
+
+  def key(self, name):
+    """
+    Returns the form of a name the ids map is keyed by
+    """
+    if self.case_insensitive:
+      return (name or '').strip().lower()
+    return name
+
+  def add(self, row):
+    """
+    Adds one row to the maps, e.g. one just inserted or loaded
+    """
+    row = self.row_type(*(getattr(row, column) for column in self.columns))
+    with self.lock:
+      self.rows[row.id] = row
+      self.ids[self.key(row.name)] = row.id
+
+  def is_fresh(self):
+    ttl = app.config['REFERENCE_CACHE_TTL']
+    return (self.loaded_version == self.version
+      and time.monotonic() - self.loaded_at < ttl)
+
+  def load(self):
+    """
+    Reloads the maps from the database, ordered by id
+    """
+    version = self.version
+    columns = [getattr(self.model, column) for column in self.columns]
+    rows = db.session.query(*columns).order_by(self.model.id).all()
+    with self.lock:
+      self.rows = {row.id: row for row in rows}
+      self.ids = {self.key(row.name): row.id for row in rows}
+      self.loaded_version = version
+      self.loaded_at = time.monotonic()
+
+  def load_row(self, row_id):
+    """
+    Loads the row with this id into the maps and returns it, or None
+    """
+    columns = [getattr(self.model, column) for column in self.columns]
+    row = db.session.query(*columns).filter(self.model.id == row_id).first()
+    if row is not None:
+      self.add(row)
+    return row
+
+  def ensure_fresh(self):
+    if self.is_fresh():
+      self.hits += 1
+    else:
+      self.misses += 1
+      self.load()
+
+  def id_for(self, name):
+    """
+    Returns the id of the row with this name, or None
+    """
+    self.ensure_fresh()
+    return self.ids.get(self.key(name))
+
+  def get(self, row_id):
+    """
+    Returns the cached row with this id, or None
+    """
+    self.ensure_fresh()
+    row = self.rows.get(row_id)
+    if row is None:
+      # ids come from foreign keys, so a missing one means a row was
+      # added by another process or without going through the ORM
+      self.misses += 1
+      row = self.load_row(row_id)
+    return row
+
+  def name_for(self, row_id):
+    row = self.get(row_id)
+    return row.name if row is not None else None
+
+  def choices(self):
+    """
+    Returns (name, name) pairs in id order, as WTForms select choices
+    """
+    self.ensure_fresh()
+    return [(row.name, row.name) for row in self.rows.values()]
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'size': len(self.rows),
+      'version': self.version,
+      'fresh': self.is_fresh(),
+    }
+
+
+states = ReferenceCache(State)
+genres = ReferenceCache(Genre)
+cities = ReferenceCache(City, 'state_id', case_insensitive=True)
+
+REFERENCE_CACHES = {
+  'state': states,
+  'genre': genres,
+  'city': cities,
+}
+
+
+@event.listens_for(db.session, 'after_commit')
+def _add_committed_rows(session):
+  for cache, row in session.info.pop(PENDING_ROWS_KEY, ()):
+    cache.add(row)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_rolled_back_rows(session):
+  session.info.pop(PENDING_ROWS_KEY, None)
+
+
+def load_reference_data():
+  """
+  Loads every reference cache, used to warm a process on startup
+  """
+  for cache in REFERENCE_CACHES.values():
+    cache.load()
+
+
+def reference_stats():
+  """
+  Returns the hit/miss counters of every reference cache
+  """
+  return {kind: cache.stats() for kind, cache in REFERENCE_CACHES.items()}
+
+
+def city_and_state(city_id):
+  """
+  Returns the (city, state) names of a city id from the caches
+  """
+  city = cities.get(city_id)
+  if city is None:
+    return None, None
+  return city.name, states.name_for(city.state_id)
+
+
+# Finds a city by name, case-insensitively, or inserts it in the same
+# statement. :pattern is the name with its LIKE wildcards escaped, so the
+# match is the one cities.key() makes, served by ix_city_name_trgm.
+CITY_UPSERT = db.text('''
+  WITH existing AS (
+    SELECT id, name, state_id FROM "City" WHERE name ILIKE :pattern LIMIT 1
+  ), inserted AS (
+    INSERT INTO "City" (name, state_id)
+    SELECT :name, :state_id
+    WHERE :state_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM existing)
+    ON CONFLICT (name) DO NOTHING
+    RETURNING id, name, state_id
+  )
+  SELECT id, name, state_id FROM existing UNION ALL SELECT id, name, state_id FROM inserted
+''')
+
+
+def like_literal(text):
+  """
+  Returns text escaped to match itself in a LIKE pattern
+  """
+  return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def resolve_genres(names):
+  """
+  Returns the Genre rows for a list of genre names, in one query.
+  Unknown names are dropped without touching the database.
+  """
+  ids = [genres.id_for(name) for name in names]
+  ids = [genre_id for genre_id in ids if genre_id is not None]
+  if not ids:
+    return []
+  return Genre.query.filter(Genre.id.in_(ids)).all()
+
+
+def resolve_city(name, state_name):
+  """
+  Returns the id of the named city, matched case-insensitively, creating it
+  in the given state if needed. Returns None when the name is blank, or when
+  the city is new and the state is unknown.
+  """
+  name = (name or '').strip()
+  if not name:
+    return None
+  city_id = cities.id_for(name)
+  if city_id is not None:
+    return city_id
+  state_id = states.id_for(state_name)
+  if db.engine.dialect.name == 'postgresql':
+    row = db.session.execute(
+      CITY_UPSERT, {'name': name, 'pattern': like_literal(name), 'state_id': state_id}).first()
+    if row is not None:
+      cities.add_on_commit(db.session, row)
+      return row.id
+    if state_id is None:
+      return None
+    # a concurrent request inserted the city between our select and insert
+  city = City.query.filter(City.name.ilike(like_literal(name), escape='\\')).first()
+  if city is not None:
+    cities.add_on_commit(db.session, city)
+    return city.id
+  if state_id is None:
+    return None
+  city = City(name=name, state_id=state_id)
+  db.session.add(city)
+  db.session.flush()
+  return city.id
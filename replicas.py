@@ -0,0 +1,72 @@
+import random
+import time
+from flask import request, session
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from db_pool import PooledSQLAlchemy
+
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#----------------------------------------------------------------------------#
+# Every URI in SQLALCHEMY_REPLICA_URIS becomes a 'replica<n>' bind. GET and
+# HEAD requests read from one of them, picked at random per request; writes
+# and everything outside a request go to the primary. After a request that
+# may have written, the client's session is pinned to the primary for
+# READ_YOUR_WRITES_SECONDS so it sees its own change despite replica lag.
+
+REPLICA_INFO_KEY = 'replica_bind'
+PRIMARY_UNTIL_KEY = 'primary_until'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replica_binds(uris):
+  """
+  Returns the SQLALCHEMY_BINDS entries for the replica URIs
+  """
+  return {f'replica{index}': uri for index, uri in enumerate(uris)}
+
+
+class RoutingSession(SignallingSession):
+  """
+  Session sending reads to the replica chosen for the request, if any.
+  Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+  """
+
+  def get_bind(self, mapper=None, clause=None):
+    replica = self.info.get(REPLICA_INFO_KEY)
+    if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+      return get_state(self.app).db.get_engine(self.app, bind=replica)
+    return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(PooledSQLAlchemy):
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def route_reads_to_replicas(app, db):
+  """
+  Registers the replica binds and the request hooks choosing between the
+  primary and the replicas
+  """
+  binds = app.config['SQLALCHEMY_BINDS'] or {}
+  binds.update(replica_binds(app.config['SQLALCHEMY_REPLICA_URIS']))
+  app.config['SQLALCHEMY_BINDS'] = binds
+
+  @app.before_request
+  def choose_database():
+    replicas = list(replica_binds(app.config['SQLALCHEMY_REPLICA_URIS']))
+    if (replicas and request.method in READ_METHODS
+        and session.get(PRIMARY_UNTIL_KEY, 0) < time.time()):
+      db.session.info[REPLICA_INFO_KEY] = random.choice(replicas)
+    else:
+      db.session.info.pop(REPLICA_INFO_KEY, None)
+
+  @app.after_request
+  def stick_to_primary(response):
+    if app.config['SQLALCHEMY_REPLICA_URIS'] and request.method not in READ_METHODS:
+      session[PRIMARY_UNTIL_KEY] = time.time() + app.config['READ_YOUR_WRITES_SECONDS']
+    return response
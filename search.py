@@ -0,0 +1,168 @@
+import re
+from collections import defaultdict
+from sqlalchemy import event, or_
+from app_config import db
+from models import Venue, Artist, City, Genre, genres_venues, genres_artists
+from reference import like_literal
+
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+# Venue and artist search match the name, city and genres of a record, plus
+# the address of venues. On PostgreSQL the matching is served by the pg_trgm
+# and tsvector indexes created in migration 9d2e7a41c6f0. Other databases
+# (sqlite in tests) use an in-process inverted index built from one query.
+
+SEARCH_FIELDS = {
+  'venue': (Venue, genres_venues, 'venue_id', ('name', 'address')),
+  'artist': (Artist, genres_artists, 'artist_id', ('name',)),
+}
+
+# weight of a match on each field when ranking results
+FIELD_WEIGHTS = {'name': 4, 'address': 2, 'city': 1, 'genre': 1}
+
+
+def tokenize(text):
+  """
+  Returns the lowercased word tokens of a string
+  """
+  return re.findall(r'\w+', (text or '').lower())
+
+
+def search(kind, term, page=1, per_page=20):
+  """
+  Returns a page of ranked search results as {'count': total, 'data': [...]}
+  where each result is a dict with the id and name of a venue or artist.
+  """
+  term = (term or '').strip()
+  if not term:
+    return {'count': 0, 'data': []}
+  offset = (max(page, 1) - 1) * per_page
+  if db.engine.dialect.name == 'postgresql':
+    return _postgres_search(kind, term, per_page, offset)
+  return inverted_index.search(kind, term, per_page, offset)
+
+
+def _search_document(model, fields):
+  """
+  Returns the tsvector expression indexed by ix_<kind>_search_document
+  """
+  text = db.func.coalesce(getattr(model, fields[0]), '')
+  for field in fields[1:]:
+    text = text + ' ' + db.func.coalesce(getattr(model, field), '')
+  return db.func.to_tsvector('simple', text)
+
+
+def _postgres_search(kind, term, limit, offset):
+  """
+  Returns ranked results from PostgreSQL using the trigram and full-text indexes
+  """
+  model, genre_table, owner_key, fields = SEARCH_FIELDS[kind]
+  # the term matches literally: % and _ in it are not wildcards
+  pattern = f'%{like_literal(term)}%'
+  document = _search_document(model, fields)
+  ts_query = db.func.plainto_tsquery('simple', term)
+  city_ids = db.session.query(City.id).filter(City.name.ilike(pattern, escape='\\'))
+  genre_owner_ids = db.session.query(genre_table.c[owner_key]
+    ).join(Genre, Genre.id == genre_table.c.genre_id
+    ).filter(Genre.name.ilike(pattern, escape='\\'))
+  rank = (
+    db.func.similarity(model.name, term) * FIELD_WEIGHTS['name']
+    + db.func.ts_rank(document, ts_query)
+  ).label('rank')
+
+  rows = db.session.query(
+      model.id, model.name, rank, db.func.count().over().label('total')
+    ).filter(or_(
+      document.op('@@')(ts_query),
+      model.city_id.in_(city_ids),
+      model.id.in_(genre_owner_ids),
+      *[getattr(model, field).ilike(pattern, escape='\\') for field in fields]
+    )).order_by(db.desc('rank'), model.id).limit(limit).offset(offset).all()
+
+  total = rows[0].total if rows else 0
+  return {
+    'count': total,
+    'data': [{'id': row.id, 'name': row.name} for row in rows],
+  }
+
+
+class InvertedIndex:
+  """
+  In-process inverted index over venue and artist search fields.
+  The index maps each token to the records it appears in, weighted by the
+  best field it was found in. It is built lazily with one query per kind
+  and dropped whenever the session commits, so the next search rebuilds it.
+  """
+
+  def __init__(self):
+    self.indexes = {}
+
+  def invalidate(self):
+    self.indexes = {}
+
+  def build(self, kind):
+    """
+    Returns the postings and names of one kind, loading them from the database
+    """
+    model, genre_table, owner_key, fields = SEARCH_FIELDS[kind]
+    columns = [getattr(model, field) for field in fields]
+    rows = db.session.query(model.id, City.name, Genre.name, *columns
+      ).join(City, City.id == model.city_id
+      ).outerjoin(genre_table, genre_table.c[owner_key] == model.id
+      ).outerjoin(Genre, Genre.id == genre_table.c.genre_id).all()
+
+    postings = defaultdict(lambda: defaultdict(int))
+    names = {}
+    for row in rows:
+      record_id, city, genre, values = row[0], row[1], row[2], row[3:]
+      names[record_id] = values[0]
+      field_values = dict(zip(fields, values), city=city, genre=genre)
+      for field, value in field_values.items():
+        for token in tokenize(value):
+          # the same record appears once per genre, so keep the best weight
+          weights = postings[token]
+          weights[record_id] = max(weights[record_id], FIELD_WEIGHTS[field])
+    self.indexes[kind] = (postings, names)
+    return self.indexes[kind]
+
+  def search(self, kind, term, limit, offset):
+    """
+    Returns ranked results for records matching every token of the term.
+    A query token matches any indexed token that contains it, which mirrors
+    the substring semantics of ILIKE.
+    """
+    postings, names = self.indexes.get(kind) or self.build(kind)
+    scores = None
+    for query_token in tokenize(term):
+      token_scores = defaultdict(int)
+      for token, weights in postings.items():
+        if query_token not in token:
+          continue
+        bonus = 1 if token == query_token else 0
+        for record_id, weight in weights.items():
+          token_scores[record_id] = max(token_scores[record_id], weight + bonus)
+      if scores is None:
+        scores = token_scores
+      else:
+        scores = {
+          record_id: score + token_scores[record_id]
+          for record_id, score in scores.items() if record_id in token_scores
+        }
+    ranked = sorted((scores or {}).items(), key=lambda item: (-item[1], item[0]))
+    return {
+      'count': len(ranked),
+      'data': [
+        {'id': record_id, 'name': names[record_id]}
+        for record_id, score in ranked[offset:offset + limit]
+      ],
+    }
+
+
+inverted_index = InvertedIndex()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_inverted_index(session):
+  inverted_index.invalidate()
@@ -2,3 +2,32 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Fill the search box suggestions from /api/autocomplete as the user types.
+document.addEventListener('DOMContentLoaded', function () {
+  var input = document.querySelector('input[data-autocomplete]');
+  var list = document.getElementById('search-suggestions');
+  if (!input || !list) {
+    return;
+  }
+  var kind = input.getAttribute('data-autocomplete');
+  input.addEventListener('input', function () {
+    var prefix = input.value;
+    if (!prefix) {
+      return;
+    }
+    fetch('/api/autocomplete?type=' + kind + '&q=' + encodeURIComponent(prefix))
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        if (input.value !== prefix) {
+          return;
+        }
+        list.innerHTML = '';
+        data.results.forEach(function (result) {
+          var option = document.createElement('option');
+          option.value = result.name;
+          list.appendChild(option);
+        });
+      });
+  });
+});
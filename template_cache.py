@@ -0,0 +1,90 @@
+import os
+import time
+import click
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import func
+from app_config import app, db
+from models import Venue, Artist
+
+
+#----------------------------------------------------------------------------#
+# Template cache.
+#----------------------------------------------------------------------------#
+# Jinja compiles a template to Python the first time a process renders it.
+# The compiled code is kept in TEMPLATE_CACHE_DIR, keyed by a checksum of
+# the template source, so every worker loads it instead of compiling, and
+# `flask compile-templates` fills it at build time. TEMPLATES_AUTO_RELOAD
+# follows DEBUG, so production renders skip the check for edited files.
+# gunicorn_conf.py calls warm_up() in the master, which renders each page
+# once before the workers are forked from it.
+
+if app.config['TEMPLATE_CACHE_DIR']:
+  os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+  app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+WARM_UP_PAGES = (
+  ('GET', '/'),
+  ('GET', '/venues'),
+  ('GET', '/artists'),
+  ('GET', '/shows'),
+  ('GET', '/venues/{venue}'),
+  ('GET', '/artists/{artist}'),
+  ('POST', '/venues/search'),
+  ('POST', '/artists/search'),
+  ('GET', '/venues/create'),
+  ('GET', '/artists/create'),
+  ('GET', '/shows/create'),
+  ('GET', '/venues/{venue}/edit'),
+  ('GET', '/artists/{artist}/edit'),
+  ('GET', '/venues/0'),
+)
+
+
+def compile_templates():
+  """
+  Compiles every template into the bytecode cache and returns their names
+  """
+  names = app.jinja_env.list_templates(extensions=['html'])
+  for name in names:
+    app.jinja_env.get_template(name)
+  return names
+
+
+def warm_up():
+  """
+  Renders every page once, so the process holds the compiled templates and
+  filled caches before it serves. Returns the number of pages rendered.
+  """
+  started = time.perf_counter()
+  compile_templates()
+  with app.app_context():
+    ids = {
+      'venue': db.session.query(func.min(Venue.id)).scalar(),
+      'artist': db.session.query(func.min(Artist.id)).scalar(),
+    }
+    db.session.remove()
+  client = app.test_client()
+  rendered = 0
+  for method, path in WARM_UP_PAGES:
+    if '{' in path and None in ids.values():
+      continue
+    data = {'search_term': ''} if method == 'POST' else None
+    response = client.open(path.format(**ids), method=method, data=data)
+    if response.status_code >= 500:
+      app.logger.warning(f'Warm-up request {method} {path} returned {response.status_code}')
+    rendered += 1
+  app.logger.info(f'Warmed up {rendered} pages in {time.perf_counter() - started:.2f}s')
+  return rendered
+
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+  """
+  Compiles every template into TEMPLATE_CACHE_DIR.
+  """
+  if not app.config['TEMPLATE_CACHE_DIR']:
+    raise click.ClickException('TEMPLATE_CACHE_DIR is not set.')
+  started = time.perf_counter()
+  names = compile_templates()
+  click.echo(f'{len(names)} templates compiled into {app.config["TEMPLATE_CACHE_DIR"]} '
+    f'in {time.perf_counter() - started:.2f}s')
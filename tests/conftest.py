@@ -0,0 +1,127 @@
+import importlib
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+import pytest
+
+#----------------------------------------------------------------------------#
+# Test setup.
+#----------------------------------------------------------------------------#
+# The app reads its settings from the environment when it is imported, so
+# they are set first. Tests run against a sqlite file, or against the
+# PostgreSQL database in TEST_DATABASE_URL (migrated once per run), which
+# is what CI should use: the query plan tests only mean something there.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix='fyyur-tests-')
+
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f'sqlite:///{SCRATCH}/fyyur.db'
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+os.environ['IMAGE_CACHE_DIR'] = os.path.join(SCRATCH, 'image_cache')
+os.environ['TEMPLATE_CACHE_DIR'] = os.path.join(SCRATCH, 'template_cache')
+os.environ['PAGE_CACHE_EVICTION_DIR'] = os.path.join(SCRATCH, 'page_evictions')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+importlib.import_module('app')  # registers every route, filter and command
+
+from app_config import app as flask_app, db
+from models import State, City, Genre, Venue, Artist, Show
+import page_cache
+from autocomplete import suggestions
+from reference import REFERENCE_CACHES
+from search import inverted_index
+
+flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+
+@pytest.fixture(scope='session')
+def app():
+  with flask_app.app_context():
+    if db.engine.dialect.name == 'postgresql':
+      from flask_migrate import upgrade
+      upgrade()
+    else:
+      db.create_all()
+  return flask_app
+
+
+def reset_process_caches():
+  if page_cache.page_cache is not None:
+    page_cache.page_cache.clear()
+  for cache in REFERENCE_CACHES.values():
+    cache.invalidate()
+  suggestions.clear()
+  inverted_index.invalidate()
+
+
+@pytest.fixture
+def database(app):
+  """
+  An empty database, and process caches that know nothing of earlier tests
+  """
+  with app.app_context():
+    for table in reversed(db.metadata.sorted_tables):
+      db.session.execute(table.delete())
+    db.session.commit()
+    reset_process_caches()
+    yield db
+    db.session.remove()
+
+
+@pytest.fixture
+def client(app, database):
+  return app.test_client()
+
+
+@pytest.fixture
+def sample_data(database):
+  """
+  Three states, four genres, six cities, twelve venues, eight artists and
+  forty shows spread over forty days around now. Returns their ids.
+  """
+  states = [State(name=name) for name in ('NY', 'CA', 'TX')]
+  genres = [Genre(name=name) for name in ('Jazz', 'Rock n Roll', 'Blues', 'Folk')]
+  cities = [City(name=f'City{index}', state=states[index % 3]) for index in range(6)]
+  venues = [
+    Venue(name=f'Venue {index}', address=f'{index} Main St', phone='555',
+      image_link=f'http://images.example.com/venue{index}.jpg',
+      city=cities[index % 6], genres=[genres[index % 4]])
+    for index in range(12)
+  ]
+  artists = [
+    Artist(name=f'Artist {index}', phone=str(index),
+      image_link=f'http://images.example.com/artist{index}.jpg',
+      city=cities[index % 6], genres=[genres[(index + 1) % 4]])
+    for index in range(8)
+  ]
+  database.session.add_all(states + genres + cities + venues + artists)
+  now = datetime.now().replace(microsecond=0)
+  for index in range(40):
+    database.session.add(Show(venue=venues[index % 12], artist=artists[index % 8],
+      start_time=now + timedelta(days=index - 20, minutes=index)))
+  database.session.commit()
+  from counters import refresh_show_counters
+  refresh_show_counters(Venue, [venue.id for venue in venues])
+  refresh_show_counters(Artist, [artist.id for artist in artists])
+  database.session.commit()
+  ids = {
+    'venues': [venue.id for venue in venues],
+    'artists': [artist.id for artist in artists],
+    'genres': [genre.id for genre in genres],
+    'cities': [city.id for city in cities],
+  }
+  reset_process_caches()
+  return ids
+
+
+@pytest.fixture
+def query_budget(monkeypatch):
+  """
+  profiler.query_budget, with the page cache off so every request queries:
+  `with query_budget(3): client.get(url)` fails past three statements
+  """
+  from profiler import query_budget
+  monkeypatch.setattr(page_cache, 'page_cache', None)
+  return query_budget
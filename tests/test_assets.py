@@ -0,0 +1,54 @@
+import gzip
+import shutil
+import pytest
+import assets
+
+
+@pytest.fixture
+def built_static(app, tmp_path, monkeypatch):
+  """
+  A built copy of the stylesheets and scripts under static/, served in
+  place of the real folder
+  """
+  static = tmp_path / 'static'
+  (tmp_path / 'secret.py').write_text('SECRET_KEY = "not for clients"')
+  for folder in ('css', 'js'):
+    shutil.copytree(f'{app.static_folder}/{folder}', static / folder)
+  monkeypatch.setattr(app, 'static_folder', str(static))
+  built = assets.build_assets(str(static))
+  monkeypatch.setattr(assets, 'manifest', built)
+  return built
+
+
+def test_bundles_are_served_precompressed_and_immutable(client, built_static):
+  url = f"/static/{built_static['css/site.css']}"
+  response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+  assert response.status_code == 200
+  assert response.headers['Content-Encoding'] == 'gzip'
+  assert 'immutable' in response.headers['Cache-Control']
+  assert b'.navbar' in gzip.decompress(response.data)
+  assert client.get(url).headers.get('Content-Encoding') is None
+
+
+def test_layout_links_the_built_bundles(client, built_static):
+  page = client.get('/').data.decode()
+  assert built_static['css/site.css'] in page
+  assert 'css/main.css' not in page
+
+
+def test_layout_links_sources_without_a_build(client, monkeypatch):
+  monkeypatch.setattr(assets, 'manifest', {})
+  page = client.get('/').data.decode()
+  assert '/static/css/main.css' in page
+
+
+@pytest.mark.parametrize('path', [
+  '/static/dist/../../secret.py',
+  '/static/dist/%2e%2e/%2e%2e/secret.py',
+  '/static/dist/..%2f..%2fsecret.py',
+  '/static/dist/css/../../../secret.py',
+  '/static/dist/' + '../' * 30 + 'etc/hostname',
+  '/static/dist/manifest.json',
+])
+def test_paths_outside_the_build_are_not_served(client, built_static, path):
+  assert client.get(path).status_code == 404
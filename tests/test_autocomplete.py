@@ -0,0 +1,55 @@
+import autocomplete
+from autocomplete import suggestions, load_suggestions
+from models import Venue
+
+
+def names(client, prefix):
+  return [result['name'] for result in client.get(f'/api/autocomplete?q={prefix}').get_json()['results']]
+
+
+def rename_elsewhere(venue_id, name):
+  """
+  Renames a venue the way another worker or import-data would, leaving
+  this process's trie alone
+  """
+  Venue.query.get(venue_id).name = name
+  Venue.query.session.commit()
+
+
+def test_names_complete_from_any_word(client, sample_data):
+  assert names(client, 'venue 1') == ['Venue 1', 'Venue 10', 'Venue 11']
+  assert names(client, 'roll') == ['Rock n Roll']
+
+
+def test_stale_tries_are_rebuilt_in_the_background(app, client, sample_data, monkeypatch):
+  assert names(client, 'loft') == []
+  rename_elsewhere(sample_data['venues'][0], 'The Loft')
+  assert names(client, 'loft') == []
+  monkeypatch.setitem(app.config, 'AUTOCOMPLETE_TTL', 0)
+  # answered from the current trie while the rebuild starts
+  assert names(client, 'loft') == []
+  suggestions.refresh.join(10)
+  monkeypatch.setitem(app.config, 'AUTOCOMPLETE_TTL', 300)
+  assert names(client, 'loft') == ['The Loft']
+
+
+def test_invalidate_rebuilds_the_trie(client, sample_data):
+  assert names(client, 'loft') == []
+  rename_elsewhere(sample_data['venues'][0], 'The Loft')
+  suggestions.invalidate()
+  names(client, 'loft')
+  suggestions.refresh.join(10)
+  assert names(client, 'loft') == ['The Loft']
+
+
+def test_changes_made_during_a_rebuild_are_kept(app, sample_data, monkeypatch):
+  class ChangedDuringLoad(dict):
+    def items(self):
+      suggestions.add('venue', 0, 'The Late Show')
+      suggestions.discard('genre', sample_data['genres'][0], 'Jazz')
+      return super().items()
+
+  monkeypatch.setattr(autocomplete, 'SUGGESTION_MODELS', ChangedDuringLoad(autocomplete.SUGGESTION_MODELS))
+  load_suggestions()
+  assert suggestions.complete('late') == [('venue', 0, 'The Late Show')]
+  assert suggestions.complete('jazz') == []
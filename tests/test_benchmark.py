@@ -0,0 +1,16 @@
+import json
+from models import Venue, Artist, Job
+
+
+def versions(model):
+  return dict(model.query.with_entities(model.id, model.updated_at))
+
+
+def test_benchmark_leaves_the_data_as_it_found_it(app, sample_data, tmp_path):
+  before = (versions(Venue), versions(Artist), Job.query.count())
+  output = tmp_path / 'results.json'
+  result = app.test_cli_runner().invoke(args=['benchmark', '--requests', '2', '-o', str(output)])
+  assert result.exit_code == 0, result.output
+  routes = json.loads(output.read_text())['routes']
+  assert routes['venue edit']['requests'] == routes['artist edit']['requests'] == 2
+  assert (versions(Venue), versions(Artist), Job.query.count()) == before
@@ -0,0 +1,42 @@
+import json
+from models import Venue
+
+
+def test_bad_jsonl_lines_are_rejected_and_the_import_carries_on(app, sample_data, tmp_path):
+  source = tmp_path / 'venues.jsonl'
+  rejects = tmp_path / 'rejects.jsonl'
+  source.write_text('\n'.join([
+    json.dumps({'name': 'The Loft', 'address': '1 Pier', 'city': 'Hoboken', 'state': 'NY', 'genres': ['Jazz']}),
+    '{"name": "Half a row", "address":',
+    json.dumps(['not', 'an', 'object']),
+    '',
+    json.dumps({'name': 'Basement', 'address': '2 Pier', 'city': 'Hoboken', 'state': 'NY', 'genres': ['Blues']}),
+    json.dumps({'name': 'Nowhere', 'address': '3 Pier', 'city': 'Hoboken', 'state': 'NY', 'genres': ['Polka']}),
+  ]) + '\n')
+
+  result = app.test_cli_runner().invoke(
+    args=['import-data', 'venues', str(source), '--batch-size', '2', '--rejects', str(rejects)])
+
+  assert result.exit_code == 0, result.output
+  assert 'Imported 2 venues; 3 rows rejected.' in result.output
+  assert {name for name, in Venue.query.with_entities(Venue.name)} >= {'The Loft', 'Basement'}
+  rejected = [json.loads(line) for line in rejects.read_text().splitlines()]
+  assert [(reject['line'], reject['reason'].split(':')[0]) for reject in rejected] == [
+    (2, 'invalid JSON'), (3, 'not a JSON object'), (6, 'unknown genre Polka')]
+  assert rejected[0]['row'] == '{"name": "Half a row", "address":'
+
+
+def test_cities_and_states_that_are_not_text_do_not_stop_the_import(app, sample_data, tmp_path):
+  source = tmp_path / 'venues.jsonl'
+  source.write_text('\n'.join([
+    json.dumps({'name': 'Numbered', 'address': '4 Pier', 'city': 10001, 'state': 'NY'}),
+    json.dumps({'name': 'Stateless', 'address': '5 Pier', 'city': 'Weehawken', 'state': 7}),
+    json.dumps({'name': 'Spaced', 'address': '6 Pier', 'city': ' Hoboken ', 'state': ' NY '}),
+  ]) + '\n')
+
+  result = app.test_cli_runner().invoke(args=['import-data', 'venues', str(source)])
+
+  assert result.exit_code == 0, result.output
+  assert 'Imported 2 venues; 1 rows rejected.' in result.output
+  assert Venue.query.filter_by(name='Numbered').one().city.name == '10001'
+  assert Venue.query.filter_by(name='Spaced').one().city.name == 'Hoboken'
@@ -0,0 +1,45 @@
+import pytest
+from db_pool import limit_request_statements, pool_options
+
+
+class RecordingConnection:
+  """
+  Stands in for a SQLAlchemy connection, recording what its DBAPI cursor runs
+  """
+
+  def __init__(self):
+    self.statements = []
+    self.connection = self
+
+  def cursor(self):
+    return self
+
+  def execute(self, statement):
+    self.statements.append(statement)
+
+  def close(self):
+    pass
+
+
+def test_statement_timeout_is_not_a_connection_option(app):
+  assert 'connect_args' not in pool_options(app.config)
+
+
+def test_request_transactions_get_the_statement_timeout(app):
+  connection = RecordingConnection()
+  with app.test_request_context('/venues'):
+    limit_request_statements(connection)
+  assert connection.statements == [f"SET LOCAL statement_timeout = {app.config['DB_STATEMENT_TIMEOUT_MS']}"]
+
+
+@pytest.mark.parametrize('context', ['cli', 'no timeout'])
+def test_other_transactions_run_without_a_timeout(app, monkeypatch, context):
+  connection = RecordingConnection()
+  if context == 'cli':
+    with app.app_context():
+      limit_request_statements(connection)
+  else:
+    monkeypatch.setitem(app.config, 'DB_STATEMENT_TIMEOUT_MS', 0)
+    with app.test_request_context('/venues'):
+      limit_request_statements(connection)
+  assert connection.statements == []
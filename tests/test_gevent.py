@@ -0,0 +1,104 @@
+import io
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from conftest import ROOT
+from models import Venue
+
+pytest.importorskip('gevent')
+pytest.importorskip('gunicorn')
+Image = pytest.importorskip('PIL.Image')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+  def log_message(self, *args):
+    pass
+
+
+def free_port():
+  with socket.socket() as probe:
+    probe.bind(('127.0.0.1', 0))
+    return probe.getsockname()[1]
+
+
+def wait_until_listening(port, server, log, timeout=30):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    if server.poll() is not None:
+      raise AssertionError(log.read_text(errors='replace'))
+    try:
+      socket.create_connection(('127.0.0.1', port), timeout=1).close()
+      return
+    except OSError:
+      time.sleep(0.2)
+  raise AssertionError('gunicorn did not start')
+
+
+@pytest.fixture
+def image_host(tmp_path):
+  Image.new('RGB', (1600, 1200), (30, 90, 200)).save(tmp_path / 'source.png')
+  server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=str(tmp_path)))
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield f'http://127.0.0.1:{server.server_port}'
+  server.shutdown()
+
+
+@pytest.fixture
+def gevent_server(app, sample_data, tmp_path):
+  """
+  gunicorn with one gevent worker, patched by gunicorn_conf.py, serving
+  the test database
+  """
+  port = free_port()
+  env = dict(os.environ,
+    DATABASE_URL=app.config['SQLALCHEMY_DATABASE_URI'],
+    GUNICORN_WORKER_CLASS='gevent',
+    WEB_CONCURRENCY='1',
+    PORT=str(port),
+    IMAGE_ALLOWED_NETWORKS='127.0.0.1/32',
+    IMAGE_CACHE_DIR=str(tmp_path / 'image_cache'),
+  )
+  # gunicorn 20.0 has no __main__, so it is run the way its script runs it
+  command = [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+    '-c', 'gunicorn_conf.py', 'app:app']
+  log = tmp_path / 'gunicorn.log'
+  with open(log, 'wb') as output:
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=output, stderr=subprocess.STDOUT)
+  try:
+    wait_until_listening(port, server, log)
+    assert 'Using worker: gevent' in log.read_text(errors='replace')
+    yield f'http://127.0.0.1:{port}'
+  finally:
+    server.terminate()
+    server.wait(30)
+
+
+def test_gevent_workers_resize_thumbnails_in_the_forkserver_pool(database, sample_data, image_host, gevent_server):
+  venue_ids = sample_data['venues'][:6]
+  for venue_id in venue_ids:
+    Venue.query.get(venue_id).image_link = f'{image_host}/source.png?venue={venue_id}'
+  database.session.commit()
+  responses = {}
+
+  def fetch(venue_id):
+    with urllib.request.urlopen(f'{gevent_server}/img/venue/{venue_id}/tile', timeout=30) as response:
+      responses[venue_id] = (response.status, response.headers['Content-Type'], response.read())
+
+  requests = [threading.Thread(target=fetch, args=(venue_id,)) for venue_id in venue_ids]
+  for request in requests:
+    request.start()
+  for request in requests:
+    request.join()
+
+  assert sorted(responses) == sorted(venue_ids)
+  for status, content_type, body in responses.values():
+    assert (status, content_type) == (200, 'image/jpeg')
+    assert Image.open(io.BytesIO(body)).size == (400, 300)
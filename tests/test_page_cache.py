@@ -0,0 +1,111 @@
+import os
+import time
+import pytest
+import page_cache
+from page_cache import LRUBackend, RedisBackend, EvictionStamps
+from replicas import REPLICA_INFO_KEY
+
+
+@pytest.fixture
+def workers(tmp_path):
+  """
+  Two workers' page caches on one host
+  """
+  return LRUBackend(10, 60, str(tmp_path)), LRUBackend(10, 60, str(tmp_path))
+
+
+def test_evictions_reach_the_other_workers(workers):
+  first, second = workers
+  first.set('/venues?', 'venues', {'venues'})
+  first.set('/artists?', 'artists', {'artists'})
+  second.evict(['venues'])
+  assert first.get('/venues?') is None
+  assert first.get('/artists?') == 'artists'
+
+
+def test_pages_rendered_before_an_eviction_are_not_kept(workers):
+  first, second = workers
+  started = time.time()
+  second.evict(['venue:3'])
+  first.set('/venues/3?', 'stale venue', {'venue:3'}, started)
+  assert first.get('/venues/3?') is None
+  first.set('/venues/3?', 'venue', {'venue:3'})
+  assert first.get('/venues/3?') == 'venue'
+
+
+def test_old_stamps_are_pruned(tmp_path):
+  stamps = EvictionStamps(str(tmp_path), ttl=60)
+  stamps.stamp(['venues', 'artists'])
+  old = time.time() - 120
+  os.utime(stamps.path('venues'), (old, old))
+  stamps.prune(time.time())
+  assert os.listdir(tmp_path) == ['artists']
+
+
+@pytest.fixture
+def replica_page(app, database, tmp_path, monkeypatch):
+  """
+  A cached view reading from a replica, and the worker cache it fills
+  """
+  cache = LRUBackend(10, 60, str(tmp_path), stamp_ttl=70)
+  monkeypatch.setattr(page_cache, 'page_cache', cache)
+  binds = []
+
+  @page_cache.cached_page('venues')
+  def view():
+    binds.append(database.session.info.get(REPLICA_INFO_KEY))
+    return 'venues'
+
+  def request():
+    with app.test_request_context('/venues'):
+      database.session.info[REPLICA_INFO_KEY] = 'replica0'
+      try:
+        return view()[2]['X-Cache']
+      finally:
+        database.session.info.pop(REPLICA_INFO_KEY)
+
+  yield cache, request
+  assert set(binds) == {'replica0'}
+
+
+def test_pages_render_from_the_replica_and_are_cached(replica_page):
+  cache, request = replica_page
+  assert [request(), request()] == ['MISS', 'HIT']
+
+
+def test_replica_pages_are_not_kept_right_after_an_eviction(app, replica_page):
+  cache, request = replica_page
+  cache.evict(['venues'])
+  assert [request(), request()] == ['MISS', 'MISS']
+  old = time.time() - app.config['READ_YOUR_WRITES_SECONDS'] - 1
+  os.utime(cache.stamps.path('venues'), (old, old))
+  assert [request(), request()] == ['MISS', 'HIT']
+
+
+def test_redis_drops_pages_rendered_before_an_eviction():
+  url = os.environ.get('TEST_REDIS_URL')
+  if not url or page_cache.redis is None:
+    pytest.skip('needs the redis package and TEST_REDIS_URL')
+  first, second = (RedisBackend(url, 60, prefix='fyyur:test:') for _ in range(2))
+  first.clear()
+  started = time.time()
+  first.set('/venues?', 'venues', {'venues'})
+  assert second.get('/venues?') == 'venues'
+  second.evict(['venues'])
+  first.set('/venues?', 'stale venues', {'venues'}, started)
+  assert first.get('/venues?') is None
+  first.set('/venues?', 'venues', {'venues'})
+  assert second.get('/venues?') == 'venues'
+  first.clear()
+
+
+def test_edits_evict_pages_in_every_worker(client, sample_data, monkeypatch):
+  other_worker = LRUBackend(10, 60, page_cache.page_cache.stamps.directory)
+  venue_id = sample_data['venues'][0]
+  other_worker.set(f'/venues/{venue_id}?', 'old venue page', {f'venue:{venue_id}'})
+  response = client.post(f'/venues/{venue_id}/edit', data={
+    'name': 'Renamed', 'city': 'City0', 'state': 'NY', 'address': '1 Main St',
+    'phone': '555', 'genres': ['Jazz'], 'image_link': '', 'facebook_link': '',
+    'website': '', 'seeking_description': ''})
+  assert response.status_code == 302
+  assert other_worker.get(f'/venues/{venue_id}?') is None
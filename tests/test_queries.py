@@ -0,0 +1,47 @@
+import re
+from html import unescape
+from models import City, Venue
+from queries import venue_areas
+
+
+def walk_areas(per_page):
+  """
+  Returns every page of venue_areas as lists of (state, city, venue name)
+  """
+  pages, cursor = [], None
+  while True:
+    areas, cursor = venue_areas(cursor, per_page=per_page)
+    pages.append([(area['state'], area['city'], venue['name']) for area in areas for venue in area['venues']])
+    if cursor is None:
+      return pages
+
+
+def test_pages_hold_a_fixed_number_of_venues_however_big_a_city_is(database, sample_data):
+  big_city = City.query.get(sample_data['cities'][0])
+  database.session.add_all(
+    Venue(name=f'Crowded {index:03}', address=f'{index} Side St', city=big_city) for index in range(40))
+  database.session.commit()
+  pages = walk_areas(per_page=15)
+  assert [len(page) for page in pages] == [15, 15, 15, 7]
+  venues = [venue for page in pages for venue in page]
+  assert venues == sorted(venues)
+  assert len(set(venues)) == Venue.query.count()
+
+
+def test_cities_spanning_pages_continue_on_the_next(database, sample_data):
+  first, second = walk_areas(per_page=3)[:2]
+  # two venues per city, so the second city is split across the pages
+  assert first[-1][:2] == second[0][:2]
+  assert first[-1] < second[0]
+
+
+def test_broken_cursors_start_from_the_first_page(database, sample_data):
+  assert venue_areas('not-a-cursor', per_page=5) == venue_areas(None, per_page=5)
+
+
+def test_venues_page_links_the_next_page(app, client, sample_data, monkeypatch):
+  monkeypatch.setitem(app.config, 'VENUES_PER_PAGE', 5)
+  page = client.get('/venues').data.decode()
+  assert page.count('<h5>') == 5
+  next_url = unescape(re.search(r'href="(/venues\?after=[^"]+)"', page).group(1))
+  assert client.get(next_url).data.decode().count('<h5>') == 5
@@ -0,0 +1,25 @@
+import pytest
+from profiler import QUERY_BUDGETS
+
+
+@pytest.mark.parametrize('route, budget', QUERY_BUDGETS.items())
+def test_pages_stay_within_their_query_budget(client, sample_data, query_budget, route, budget):
+  url = route.format(venue=sample_data['venues'][0], artist=sample_data['artists'][0])
+  # the first request loads the reference caches and the trie
+  assert client.get(url).status_code == 200
+  with query_budget(budget):
+    assert client.get(url).status_code == 200
+
+
+def test_pages_over_budget_fail(client, sample_data, query_budget):
+  client.get('/venues')
+  with pytest.raises(AssertionError, match='budget 0'):
+    with query_budget(0):
+      client.get('/venues')
+
+
+def test_query_profiles_are_served_while_debugging(client, sample_data):
+  # the tests import the app in debug mode, which registers the route
+  client.get('/venues')
+  profiles = client.get('/api/metrics/queries').get_json()
+  assert profiles[-1]['path'] == '/venues'
@@ -0,0 +1,41 @@
+import pytest
+from benchmark import seed_data
+from models import Show
+from query_plans import HOT_QUERIES, check_query_plans
+
+# enough rows that PostgreSQL prefers the indexes when they exist
+SEED_VOLUME = {'cities': 100, 'venues': 2000, 'artists': 2000, 'shows': 20000}
+
+
+@pytest.fixture
+def seeded(database):
+  seed_data(**SEED_VOLUME)
+  if database.engine.dialect.name == 'postgresql':
+    database.session.execute('ANALYZE')
+    database.session.commit()
+  return database
+
+
+@pytest.fixture
+def index_dropped(seeded):
+  """
+  The seeded database without the index serving a venue's shows
+  """
+  index = next(index for index in Show.__table__.indexes if index.name == 'ix_show_venue_id_start_time')
+  index.drop(seeded.engine)
+  if seeded.engine.dialect.name == 'postgresql':
+    seeded.session.execute('ANALYZE "Show"')
+    seeded.session.commit()
+  yield
+  index.create(seeded.engine)
+
+
+def test_hot_queries_use_indexes(seeded):
+  assert check_query_plans() == {}
+
+
+def test_a_dropped_index_fails_the_check(index_dropped):
+  failures = check_query_plans()
+  assert 'venue show partition' in failures
+  assert all(tables == {'Show'} for statement, tables in failures['venue show partition'])
+  assert set(failures) < set(HOT_QUERIES)
@@ -0,0 +1,49 @@
+from models import City
+from reference import cities, resolve_city
+
+
+def test_city_names_match_whatever_their_case(database, sample_data, query_budget):
+  city_id = cities.id_for('City1')
+  with query_budget(0):
+    assert resolve_city('  city1 ', 'NY') == city_id
+    assert cities.id_for('CITY1') == city_id
+  assert City.query.count() == 6
+
+
+def test_like_wildcards_in_names_are_literal(database, sample_data):
+  city_id = resolve_city('City_', 'NY')
+  database.session.commit()
+  assert city_id not in sample_data['cities']
+  assert City.query.get(city_id).name == 'City_'
+
+
+def test_new_cities_join_the_cache_once_committed(database, sample_data, query_budget):
+  cities.id_for('City0')
+  loaded_version = cities.loaded_version
+  city_id = resolve_city('Hoboken', 'NY')
+  database.session.commit()
+  with query_budget(0):
+    assert cities.id_for('hoboken') == city_id
+    assert cities.get(city_id).name == 'Hoboken'
+  assert cities.loaded_version == loaded_version
+
+
+def test_rolled_back_cities_are_forgotten(database, sample_data):
+  cities.id_for('City0')
+  resolve_city('Hoboken', 'NY')
+  database.session.rollback()
+  assert cities.id_for('Hoboken') is None
+  assert City.query.filter_by(name='Hoboken').first() is None
+
+
+def test_unknown_ids_load_only_their_row(database, sample_data, query_budget):
+  cities.id_for('City0')
+  # a city written by another process
+  database.session.execute(City.__table__.insert().values(name='Jersey City', state_id=City.query.first().state_id))
+  database.session.commit()
+  city_id = database.session.query(City.id).filter_by(name='Jersey City').scalar()
+  loaded_version = cities.loaded_version
+  with query_budget(1):
+    assert cities.get(city_id).name == 'Jersey City'
+  assert cities.id_for('jersey city') == city_id
+  assert cities.loaded_version == loaded_version
@@ -0,0 +1,68 @@
+import pytest
+from models import Venue
+from search import search, inverted_index, _postgres_search
+
+# single words, where ILIKE and the index's substring matching agree: on
+# names, addresses, cities and genres, some matching nothing, and LIKE
+# wildcards, which must match literally
+PARITY_TERMS = ['venue', 'Venue', 'artist', 'city1', 'jazz', 'ROLL', 'main', '5', 'st', 'nowhere',
+  '_', '%', 'city_', 'c%y']
+
+
+def ids(results):
+  return {result['id'] for result in results['data']}
+
+
+@pytest.fixture
+def postgres(database):
+  if database.engine.dialect.name != 'postgresql':
+    pytest.skip('needs TEST_DATABASE_URL pointing at PostgreSQL')
+
+
+@pytest.mark.parametrize('kind', ['venue', 'artist'])
+@pytest.mark.parametrize('term', PARITY_TERMS)
+def test_both_backends_find_the_same_records(postgres, sample_data, kind, term):
+  expected = _postgres_search(kind, term, limit=100, offset=0)
+  found = inverted_index.search(kind, term, limit=100, offset=0)
+  assert found['count'] == expected['count']
+  assert ids(found) == ids(expected)
+
+
+@pytest.mark.parametrize('kind, name', [('venue', 'Venue 7'), ('artist', 'Artist 3')])
+def test_both_backends_rank_the_exact_name_first(postgres, sample_data, kind, name):
+  assert _postgres_search(kind, name, limit=1, offset=0)['data'][0]['name'] == name
+  assert inverted_index.search(kind, name, limit=1, offset=0)['data'][0]['name'] == name
+
+
+def test_name_matches_rank_above_genre_matches(database, sample_data):
+  Venue.query.get(sample_data['venues'][1]).name = 'The Jazz Cellar'
+  database.session.commit()
+  results = search('venue', 'jazz')
+  assert results['data'][0]['name'] == 'The Jazz Cellar'
+  # Venue 0, 4 and 8 play jazz
+  assert results['count'] == 4
+
+
+def test_every_word_of_the_term_must_match(sample_data):
+  assert [result['name'] for result in search('venue', 'venue 11')['data']] == ['Venue 11']
+  assert search('venue', 'venue nowhere') == {'count': 0, 'data': []}
+  assert search('venue', '   ') == {'count': 0, 'data': []}
+
+
+def test_like_wildcards_match_literally(sample_data):
+  assert search('venue', '_')['count'] == 0
+  assert search('artist', '%')['count'] == 0
+
+
+def test_results_are_paged(sample_data):
+  first, second = search('artist', 'artist', page=1, per_page=5), search('artist', 'artist', page=2, per_page=5)
+  assert first['count'] == second['count'] == 8
+  assert len(first['data']) == 5 and len(second['data']) == 3
+  assert not ids(first) & ids(second)
+
+
+def test_the_index_follows_commits(database, sample_data):
+  assert search('venue', 'loft')['count'] == 0
+  Venue.query.get(sample_data['venues'][0]).name = 'The Loft'
+  database.session.commit()
+  assert [result['name'] for result in search('venue', 'loft')['data']] == ['The Loft']
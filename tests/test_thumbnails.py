@@ -0,0 +1,187 @@
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import thumbnails
+from models import Venue
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png(width, height):
+  data = io.BytesIO()
+  Image.new('RGB', (width, height), (200, 30, 30)).save(data, 'PNG')
+  return data.getvalue()
+
+
+class Upstream(BaseHTTPRequestHandler):
+  """
+  Local stand-in for the hosts image_link points at
+  """
+  image = png(2400, 1600)
+  requests = []
+
+  def do_GET(self):
+    self.requests.append(self.path)
+    if self.path.startswith('/redirect'):
+      self.send_response(302)
+      self.send_header('Location', self.path.split('?to=', 1)[1])
+      self.end_headers()
+      return
+    body = b'not an image' if self.path.startswith('/broken') else self.image
+    self.send_response(200)
+    self.send_header('Content-Type', 'image/png')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def upstream():
+  server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  Upstream.requests = []
+  yield f'http://127.0.0.1:{server.server_port}'
+  server.shutdown()
+
+
+@pytest.fixture
+def image_cache(app, tmp_path, monkeypatch):
+  cache = thumbnails.thumbnail_cache
+  monkeypatch.setattr(cache, 'root', str(tmp_path))
+  monkeypatch.setattr(cache, 'failed', OrderedDict())
+  return cache
+
+
+@pytest.fixture
+def local_upstream_allowed(app, monkeypatch):
+  monkeypatch.setitem(app.config, 'IMAGE_ALLOWED_NETWORKS', ['127.0.0.1/32'])
+
+
+def set_image(database, venue_id, link):
+  Venue.query.get(venue_id).image_link = link
+  database.session.commit()
+
+
+def test_thumbnail_is_resized_and_cached_for_good(
+    client, database, sample_data, upstream, image_cache, local_upstream_allowed):
+  venue_id = sample_data['venues'][0]
+  set_image(database, venue_id, f'{upstream}/venue.png')
+  page = client.get(f'/venues/{venue_id}').data.decode()
+  url = re.search(rf'/img/venue/{venue_id}/page\?v=\w+', page).group()
+
+  response = client.get(url)
+  assert response.status_code == 200
+  assert Image.open(io.BytesIO(response.data)).size == (800, 533)
+  assert 'immutable' in response.headers['Cache-Control']
+  assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+  tile = client.get(f'/img/venue/{venue_id}/tile')
+  assert Image.open(io.BytesIO(tile.data)).size == (400, 267)
+  assert 'immutable' not in tile.headers['Cache-Control']
+  assert Upstream.requests == ['/venue.png']
+
+
+def test_concurrent_requests_fetch_a_source_once(
+    app, database, sample_data, upstream, image_cache, local_upstream_allowed):
+  venue_id = sample_data['venues'][1]
+  set_image(database, venue_id, f'{upstream}/shared.png')
+  statuses = []
+
+  def request_thumbnail():
+    statuses.append(app.test_client().get(f'/img/venue/{venue_id}/tile').status_code)
+
+  requests = [threading.Thread(target=request_thumbnail) for _ in range(5)]
+  for request in requests:
+    request.start()
+  for request in requests:
+    request.join()
+  assert statuses == [200] * 5
+  assert Upstream.requests == ['/shared.png']
+
+
+def test_thumbnails_evicted_before_they_are_opened_are_made_again(
+    client, database, sample_data, upstream, image_cache, local_upstream_allowed, monkeypatch):
+  venue_id = sample_data['venues'][4]
+  set_image(database, venue_id, f'{upstream}/evicted.png')
+  assert client.get(f'/img/venue/{venue_id}/tile').status_code == 200
+  found = image_cache.get
+
+  def evicted_by_another_worker(source_url, size):
+    path = found(source_url, size)
+    monkeypatch.setattr(image_cache, 'get', found)
+    for name in os.listdir(os.path.dirname(path)):
+      os.remove(os.path.join(os.path.dirname(path), name))
+    return path
+
+  monkeypatch.setattr(image_cache, 'get', evicted_by_another_worker)
+  response = client.get(f'/img/venue/{venue_id}/tile')
+  assert response.status_code == 200
+  assert Image.open(io.BytesIO(response.data)).size == (400, 267)
+  assert response.content_length == len(response.data)
+  assert Upstream.requests == ['/evicted.png', '/evicted.png']
+
+
+def test_broken_sources_redirect_to_the_original(
+    client, database, sample_data, upstream, image_cache, local_upstream_allowed):
+  venue_id = sample_data['venues'][2]
+  set_image(database, venue_id, f'{upstream}/broken.png')
+  response = client.get(f'/img/venue/{venue_id}/tile')
+  assert response.status_code == 302
+  assert response.location == f'{upstream}/broken.png'
+  client.get(f'/img/venue/{venue_id}/tile')
+  assert Upstream.requests == ['/broken.png']
+
+
+def test_loopback_sources_are_refused(client, database, sample_data, upstream, image_cache):
+  venue_id = sample_data['venues'][3]
+  set_image(database, venue_id, f'{upstream}/venue.png')
+  assert client.get(f'/img/venue/{venue_id}/tile').status_code == 302
+  assert Upstream.requests == []
+
+
+def test_redirects_to_private_addresses_are_refused(
+    client, database, sample_data, upstream, image_cache, local_upstream_allowed):
+  venue_id = sample_data['venues'][4]
+  set_image(database, venue_id, f'{upstream}/redirect?to=http://169.254.169.254/latest/meta-data/')
+  assert client.get(f'/img/venue/{venue_id}/tile').status_code == 302
+  assert len(Upstream.requests) == 1
+
+
+@pytest.mark.parametrize('url', [
+  'http://127.0.0.1/',
+  'http://localhost/',
+  'http://10.0.0.8/',
+  'http://192.168.1.1/',
+  'http://169.254.169.254/latest/meta-data/',
+  'http://[::1]/',
+  'http://[::ffff:127.0.0.1]/',
+  'http://0.0.0.0/',
+])
+def test_non_public_addresses_are_refused_before_connecting(app, url):
+  with pytest.raises(thumbnails.BlockedSource):
+    thumbnails.fetch_source(url)
+
+
+def test_failed_sources_are_bounded(app, image_cache, monkeypatch):
+  monkeypatch.setattr(thumbnails, 'MAX_FAILED_SOURCES', 3)
+  for index in range(10):
+    assert image_cache.get(f'ftp://images.example.com/{index}.png', 'tile') is None
+  assert list(image_cache.failed) == [f'ftp://images.example.com/{index}.png' for index in (7, 8, 9)]
+
+
+def test_least_recently_served_files_are_evicted(
+    client, database, sample_data, upstream, image_cache, local_upstream_allowed, monkeypatch):
+  for index, venue_id in enumerate(sample_data['venues'][:2]):
+    Upstream.image = png(1200 + index, 800)
+    set_image(database, venue_id, f'{upstream}/{index}.png')
+    assert client.get(f'/img/venue/{venue_id}/tile').status_code == 200
+  monkeypatch.setattr(image_cache, 'max_bytes', 1)
+  image_cache.evict()
+  assert image_cache.thumbnail_path(f'{upstream}/0.png', 'tile') is None
@@ -0,0 +1,363 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from flask import abort, redirect, request, send_file, url_for
+from app_config import app, db
+from models import Venue, Artist
+
+try:
+  from PIL import Image, ImageOps
+except ImportError:
+  Image = None
+
+
+#----------------------------------------------------------------------------#
+# Thumbnails.
+#----------------------------------------------------------------------------#
+# /img/<kind>/<id>/<size> serves a venue or artist image_link scaled down
+# to one of THUMBNAIL_SIZES. A source is fetched once and resized to every
+# size in a process pool; the thumbnails are stored under the hash of
+# their content, next to small files mapping the hash of each source URL
+# to it, and the least recently served files are evicted once the cache
+# grows past IMAGE_CACHE_MAX_BYTES. Templates link to thumbnail() URLs,
+# which carry a hash of the source URL, so responses can be cached for good.
+# Without Pillow installed the endpoint redirects to the original image.
+#
+# Anyone can set an image_link, so sources are only fetched from public
+# addresses: every connection, including those of redirects, is checked
+# before and after it is made, unless IMAGE_ALLOWED_NETWORKS lists it.
+
+THUMBNAIL_MODELS = {'venue': Venue, 'artist': Artist}
+
+# seconds before a source that could not be fetched or decoded is tried
+# again, and how many such sources a process remembers
+FAILED_SOURCE_RETRY = 300
+MAX_FAILED_SOURCES = 1024
+
+MAX_REDIRECTS = 3
+
+
+def url_digest(source_url):
+  return hashlib.sha256(source_url.encode('utf-8')).hexdigest()
+
+
+def thumbnail(kind, record_id, image_link, size='tile'):
+  """
+  Returns the URL of a venue or artist thumbnail, or '' when it has no image
+  """
+  if not image_link:
+    return ''
+  return url_for('serve_thumbnail', kind=kind, record_id=record_id, size=size,
+    v=url_digest(image_link)[:12])
+
+app.jinja_env.globals['thumbnail'] = thumbnail
+
+
+class BlockedSource(ValueError):
+  """
+  Raised for image sources on loopback, private, link-local and other
+  non-public addresses
+  """
+
+
+def check_address(address):
+  """
+  Raises BlockedSource unless an IP address is public or allowed
+  """
+  ip = ipaddress.ip_address(address.split('%')[0])
+  if ip.version == 6 and ip.ipv4_mapped is not None:
+    ip = ip.ipv4_mapped
+  if ip.is_global and not ip.is_multicast:
+    return
+  if any(ip in ipaddress.ip_network(network) for network in app.config['IMAGE_ALLOWED_NETWORKS']):
+    return
+  raise BlockedSource(f'{address} is not a public address')
+
+
+def check_host(host, port):
+  """
+  Raises BlockedSource unless every address of a host is public or allowed
+  """
+  try:
+    addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+  except socket.gaierror as error:
+    raise BlockedSource(f'Cannot resolve {host}: {error}')
+  for family, kind, proto, name, sockaddr in addresses:
+    check_address(sockaddr[0])
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+  """
+  Connection that refuses non-public hosts, checking the resolved
+  addresses first and the connected peer after, which also covers a name
+  resolving differently the second time
+  """
+
+  def connect(self):
+    check_host(self.host, self.port)
+    super().connect()
+    check_address(self.sock.getpeername()[0])
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+
+  def connect(self):
+    check_host(self.host, self.port)
+    super().connect()
+    check_address(self.sock.getpeername()[0])
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+
+  def http_open(self, req):
+    return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+
+  def https_open(self, req):
+    return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class SourceRedirectHandler(urllib.request.HTTPRedirectHandler):
+  max_redirections = MAX_REDIRECTS
+
+
+def source_opener():
+  """
+  Returns an opener for http(s) only, without proxies, whose every
+  connection is checked by PublicHTTP(S)Connection
+  """
+  opener = urllib.request.OpenerDirector()
+  for handler in (
+    PublicHTTPHandler(), PublicHTTPSHandler(), SourceRedirectHandler(),
+    urllib.request.HTTPDefaultErrorHandler(), urllib.request.HTTPErrorProcessor(),
+    urllib.request.UnknownHandler(),
+  ):
+    opener.add_handler(handler)
+  return opener
+
+
+def fetch_source(source_url):
+  """
+  Returns the bytes of a source image, refusing anything but http(s) on
+  public addresses and anything larger than IMAGE_MAX_SOURCE_BYTES
+  """
+  if not source_url.startswith(('http://', 'https://')):
+    raise ValueError(f'Unsupported image URL {source_url}')
+  upstream = urllib.request.Request(source_url, headers={'User-Agent': 'fyyur-thumbnails'})
+  limit = app.config['IMAGE_MAX_SOURCE_BYTES']
+  with source_opener().open(upstream, timeout=app.config['IMAGE_FETCH_TIMEOUT']) as response:
+    data = response.read(limit + 1)
+  if len(data) > limit:
+    raise ValueError(f'Image larger than {limit} bytes at {source_url}')
+  return data
+
+
+def resize(data, sizes, quality):
+  """
+  Returns {size name: JPEG bytes} of an image scaled to fit each of sizes,
+  a {name: pixels} dict. Runs in the thumbnail process pool.
+  """
+  image = Image.open(io.BytesIO(data))
+  image = ImageOps.exif_transpose(image)
+  if image.mode != 'RGB':
+    image = image.convert('RGB')
+  thumbnails = {}
+  for name, pixels in sizes.items():
+    scaled = image.copy()
+    scaled.thumbnail((pixels, pixels), Image.LANCZOS)
+    out = io.BytesIO()
+    scaled.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    thumbnails[name] = out.getvalue()
+  return thumbnails
+
+
+class ThumbnailCache:
+  """
+  Directory of thumbnails named by their content hash, plus one small file
+  per source URL naming the content hash of its image. Files are written
+  atomically, so every worker process can share the directory. Serving a
+  file bumps its mtime, which orders the eviction.
+  """
+
+  def __init__(self, root, max_bytes, sizes):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.sizes = sizes
+    self.pool = None
+    self.pool_pid = None
+    self.lock = threading.Lock()
+    self.fetching = {}
+    self.failed = OrderedDict()
+    self.written = 0
+
+  def path(self, *parts):
+    return os.path.join(self.root, *parts)
+
+  def thumbnail_path(self, source_url, size):
+    """
+    Returns the path of a source's thumbnail when it is cached, or None
+    """
+    mapping = self.path('sources', url_digest(source_url))
+    try:
+      with open(mapping) as source:
+        content = source.read().strip()
+      path = self.path('thumbs', content[:2], f'{content}-{size}.jpg')
+      os.utime(path)
+      os.utime(mapping)
+      return path
+    except FileNotFoundError:
+      return None
+
+  def get(self, source_url, size):
+    """
+    Returns the path of a source's thumbnail, fetching and resizing the
+    source the first time. Concurrent requests for the same source in this
+    process wait for the first one instead of fetching it again.
+    """
+    path = self.thumbnail_path(source_url, size)
+    if path is not None:
+      return path
+    with self.lock:
+      failed_at = self.failed.get(source_url)
+      if failed_at is not None and time.monotonic() - failed_at < FAILED_SOURCE_RETRY:
+        return None
+      pending = self.fetching.get(source_url)
+      first = pending is None
+      if first:
+        pending = self.fetching[source_url] = threading.Event()
+    if not first:
+      pending.wait(app.config['IMAGE_FETCH_TIMEOUT'] * 2)
+      return self.thumbnail_path(source_url, size)
+    try:
+      data = fetch_source(source_url)
+      resizing = self.executor().submit(resize, data, self.sizes, app.config['THUMBNAIL_QUALITY'])
+      self.store(source_url, resizing.result())
+    except Exception as error:
+      app.logger.warning(f'Could not make thumbnails of {source_url}: {error}')
+      with self.lock:
+        self.failed[source_url] = time.monotonic()
+        self.failed.move_to_end(source_url)
+        while len(self.failed) > MAX_FAILED_SOURCES:
+          self.failed.popitem(last=False)
+      return None
+    finally:
+      with self.lock:
+        del self.fetching[source_url]
+      pending.set()
+    return self.thumbnail_path(source_url, size)
+
+  def open_thumbnail(self, source_url, size):
+    """
+    Returns (path, open file) of a source's thumbnail as get() makes it, or
+    None. Another worker's eviction can delete the file between get() and
+    opening it, in which case it is made once more.
+    """
+    for attempt in range(2):
+      path = self.get(source_url, size)
+      if path is None:
+        return None
+      try:
+        return path, open(path, 'rb')
+      except FileNotFoundError:
+        continue
+    return None
+
+  def store(self, source_url, thumbnails):
+    """
+    Writes the thumbnails of a source, then the file mapping its URL to them
+    """
+    content = hashlib.sha256(b''.join(thumbnails[name] for name in sorted(thumbnails))).hexdigest()
+    for name, data in thumbnails.items():
+      self.write(self.path('thumbs', content[:2], f'{content}-{name}.jpg'), data)
+    self.write(self.path('sources', url_digest(source_url)), content.encode('ascii'))
+    self.written += sum(len(data) for data in thumbnails.values())
+    if self.written > self.max_bytes // 20:
+      self.evict()
+
+  def write(self, path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(partial, 'wb') as out:
+      out.write(data)
+    os.replace(partial, path)
+
+  def evict(self):
+    """
+    Deletes the least recently served files until the cache is back under
+    90% of max_bytes. A source whose thumbnail or mapping is gone is fetched
+    again on its next request.
+    """
+    self.written = 0
+    files = []
+    for directory, _, names in os.walk(self.root):
+      for name in names:
+        try:
+          stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+          continue
+        files.append((stat.st_mtime, stat.st_size, os.path.join(directory, name)))
+    total = sum(size for _, size, _ in files)
+    if total <= self.max_bytes:
+      return
+    files.sort()
+    for _, size, path in files:
+      if total <= self.max_bytes * 0.9:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total -= size
+
+  def executor(self):
+    """
+    Returns this process's resize pool, started on first use so that each
+    forked web worker gets its own
+    """
+    if self.pool is None or self.pool_pid != os.getpid():
+      self.pool = ProcessPoolExecutor(app.config['THUMBNAIL_PROCESSES'],
+        mp_context=multiprocessing.get_context('forkserver'))
+      self.pool_pid = os.getpid()
+    return self.pool
+
+
+thumbnail_cache = ThumbnailCache(
+  app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_CACHE_MAX_BYTES'], app.config['THUMBNAIL_SIZES'])
+
+
+@app.route('/img/<kind>/<int:record_id>/<size>')
+def serve_thumbnail(kind, record_id, size):
+  model = THUMBNAIL_MODELS.get(kind)
+  if model is None or size not in app.config['THUMBNAIL_SIZES']:
+    abort(404)
+  source_url = db.session.query(model.image_link).filter(model.id == record_id).scalar()
+  if not source_url:
+    abort(404)
+  if Image is None:
+    return redirect(source_url)
+  opened = thumbnail_cache.open_thumbnail(source_url, size)
+  if opened is None:
+    return redirect(source_url)
+  path, thumbnail_file = opened
+  # the file name is its content hash; its mtime only tracks recent use
+  response = send_file(thumbnail_file, mimetype='image/jpeg', add_etags=False)
+  response.content_length = os.fstat(thumbnail_file.fileno()).st_size
+  response.set_etag(os.path.basename(path)[:-len('.jpg')])
+  response.make_conditional(request)
+  if request.args.get('v') == url_digest(source_url)[:12]:
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+  else:
+    # an unversioned or outdated link: the image_link may change again
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+  return response